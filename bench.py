@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+from omron_envsensor import OmronEnvSensor
+from omron_envsensor import ble, decoder, sensorbeacon
+from omron_envsensor.sensorbeacon import SensorBeacon, CompactSensorBeacon
+from omron_envsensor.synthetic import TrafficGenerator
+from omron_envsensor import util
+from omron_envsensor.serialize import JSONSerializer
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+timer = getattr(time, 'perf_counter', time.time)
+
+FIELDS = ['bt_address', 'sensor_type', 'gateway', 'seq_num', 'val_temp',
+          'val_humi', 'val_light', 'val_uv', 'val_pressure', 'val_noise',
+          'val_di', 'val_heat', 'val_ax', 'val_ay', 'val_az', 'val_battery',
+          'rssi', 'distance']
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'items': len(latencies),
+        'per_sec': len(latencies) / total if total else 0.0,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p90_us': percentile(latencies, 90) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+    }
+
+
+def timed(func, items):
+    # run func on every item, returns (results, latencies)
+    results = []
+    latencies = []
+    for item in items:
+        start = timer()
+        r = func(item)
+        latencies.append(timer() - start)
+        results.append(r)
+    return results, latencies
+
+
+def check_identical(sensor, frames):
+    for pkt in frames:
+        sensor.fast_decode = False
+        slow = sensor.decode(pkt)
+        sensor.fast_decode = True
+        fast = sensor.decode(pkt)
+        if len(slow) != len(fast):
+            raise AssertionError('beacon count differs')
+        for a, b in zip(slow, fast):
+            for field in FIELDS:
+                if repr(getattr(a, field)) != repr(getattr(b, field)):
+                    raise AssertionError('%s differs: %r != %r' % (
+                        field, getattr(a, field), getattr(b, field)))
+
+
+def stages(sensor, frames):
+    result = {}
+    _, result['prefilter'] = timed(decoder.is_omron_frame, frames)
+
+    parsed, result['parse'] = timed(ble.hci_le_parse_response_packet, frames)
+    _, result['parse_lazy_hex'] = timed(
+        lambda pkt: ble.hci_le_parse_response_packet(pkt, lazy_hex=True),
+        frames)
+
+    # the sensor's own filter_all: verification plus record construction
+    _, result['filter'] = timed(sensor.filter_all, parsed)
+    reports = [report for r in parsed
+               for report in r.get('advertising_reports', ())
+               if sensorbeacon.verify_beacon_packet(report)]
+
+    beacons, result['SensorBeacon'] = timed(
+        lambda report: SensorBeacon(
+            report['peer_bluetooth_address_s'],
+            util.classify_beacon_packet(report), sensor.name,
+            report['payload_binary']), reports)
+    _, result['csv_format'] = timed(SensorBeacon.csv_format, beacons)
+    _, result['json_format'] = timed(SensorBeacon.json_format, beacons)
+    _, result['ndjson_line'] = timed(JSONSerializer().line, beacons)
+
+    for label, fast_decode in (('decode', False), ('decode_fast', True)):
+        sensor.fast_decode = fast_decode
+        _, result[label] = timed(sensor.decode, frames)
+    sensor.fast_decode = False
+    return dict((k, summarize(v)) for k, v in result.items())
+
+
+def record_memory(sensor, frames, beacon_class):
+    sensor.beacon_class = beacon_class
+    sensor.fast_decode = True
+    decode = sensor.decode
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [r for pkt in frames for r in decode(pkt)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    count = max(len(kept), 1)
+    sensor.beacon_class = SensorBeacon
+    sensor.fast_decode = False
+    return {'bytes_per_record': size / float(count),
+            'allocations_per_record': blocks / float(count)}
+
+
+STAGE_ORDER = ['prefilter', 'parse', 'parse_lazy_hex', 'filter',
+               'SensorBeacon', 'csv_format', 'json_format', 'ndjson_line',
+               'decode',
+               'decode_fast']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='omron_envsensor benchmark')
+    parser.add_argument('-n', '--count', type=int, default=20000,
+                        help='number of HCI frames')
+    parser.add_argument('--foreign-ratio', type=float, default=0.9,
+                        help='share of non-Omron reports')
+    parser.add_argument('--multi-ratio', type=float, default=0.1,
+                        help='share of events with several reports')
+    parser.add_argument('--max-reports', type=int, default=3)
+    parser.add_argument('--sensors', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='JSON output of an earlier run (e.g. on a '
+                             'Raspberry Pi) to compare items/s against')
+    args = parser.parse_args()
+
+    generator = TrafficGenerator(
+        sensors=args.sensors, foreign_ratio=args.foreign_ratio,
+        multi_ratio=args.multi_ratio, max_reports=args.max_reports,
+        seed=args.seed)
+    frames = generator.frames(args.count)
+
+    sensor = OmronEnvSensor('bench', 0)
+    check_identical(sensor, frames)
+
+    report = {
+        'python': sys.version.split()[0],
+        'frames': args.count,
+        'foreign_ratio': args.foreign_ratio,
+        'multi_ratio': args.multi_ratio,
+        'seed': args.seed,
+        'stages': stages(sensor, frames),
+        'memory': dict(
+            (beacon_class.__name__,
+             record_memory(sensor, frames, beacon_class))
+            for beacon_class in (SensorBeacon, CompactSensorBeacon)),
+        'comfort_cache': sensorbeacon.comfort_indices.stats(),
+    }
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+        return
+
+    sys.stdout.write('python %(python)s, %(frames)d frames, foreign %(foreign_ratio)s, '
+                     'multi-report %(multi_ratio)s, seed %(seed)d\n' % report)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['stages']
+    sys.stdout.write('%-16s %8s %12s %9s %9s %9s%s\n' % (
+        'stage', 'items', 'items/s', 'p50 us', 'p90 us', 'p99 us',
+        ' %9s' % 'vs base' if baseline else ''))
+    for name in STAGE_ORDER:
+        s = report['stages'][name]
+        ratio = ''
+        if name in baseline and baseline[name]['per_sec']:
+            ratio = ' %8.2fx' % (s['per_sec'] / baseline[name]['per_sec'])
+        sys.stdout.write('%-16s %8d %12.0f %9.2f %9.2f %9.2f%s\n' % (
+            name, s['items'], s['per_sec'], s['p50_us'], s['p90_us'],
+            s['p99_us'], ratio))
+    for name in sorted(report['memory']):
+        m = report['memory'][name]
+        sys.stdout.write('%-20s %6.0f bytes/record %5.1f allocations/record\n' % (
+            name, m['bytes_per_record'], m['allocations_per_record']))
+    cache = report['comfort_cache']
+    sys.stdout.write('comfort index cache: %d hits, %d misses (%.1f%%)\n' % (
+        cache['hits'], cache['misses'], cache['hit_rate'] * 100))
+
+if __name__ == '__main__':
+    main()
@@ -4,27 +4,38 @@ from logging import getLogger
 logger = getLogger('omron_envsensor')
 
 from omron_envsensor import OmronEnvSensor
-from omron_envsensor.sensorbeacon import csv_header
+from omron_envsensor.multi import MultiOmronEnvSensor
+from omron_envsensor.sink import CSVSink
 from omron_envsensor.util import getHostname
 import sys
 import os
 
+# one adapter id, or several separated by commas (e.g. "0,1")
 BLUETHOOTH_DEVICEID = os.environ.get('BLUETHOOTH_DEVICEID', 0)
 
-def main():
-    sys.stdout.write(csv_header())
-    sys.stdout.write("\r\n")
+# write rotated files (strftime pattern) instead of stdout when set
+CSV_PATH = os.environ.get('OMRON_CSV_PATH')
 
+def main():
     before_seq = None
-    o = OmronEnvSensor(getHostname(), BLUETHOOTH_DEVICEID)
-
-    def callback(beacon):
-        sys.stdout.write(beacon.csv_format())
-        sys.stdout.write("\r\n")
-
-    o.on_message = callback
+    device_ids = [int(i) for i in str(BLUETHOOTH_DEVICEID).split(',')]
+    if len(device_ids) > 1:
+        o = MultiOmronEnvSensor(getHostname(), device_ids)
+    else:
+        o = OmronEnvSensor(getHostname(), device_ids[0])
+
+    if CSV_PATH:
+        sink = CSVSink(CSV_PATH, max_bytes=64 * 1024 * 1024)
+    else:
+        sink = CSVSink(sys.stdout, flush_interval=1.0)
+
+    o.on_message = sink
     o.init()
-    o.loop()
+    try:
+        o.loop()
+    finally:
+        o.close()
+        sink.close()
 
 if __name__ == '__main__':
     main()
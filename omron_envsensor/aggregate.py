@@ -0,0 +1,189 @@
+"""
+incremental time-window aggregation per sensor
+
+WindowAggregator is fed beacons (it is callable, so it can be on_message)
+and emits one summary per device and window with count / min / max / mean /
+last of every field. Windows are built from panes of `step` seconds, so a
+reading costs O(1) and sliding windows (window > step) only combine
+window / step panes when a window closes. step == window gives tumbling
+windows.
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import collections
+import datetime
+import operator
+
+from .util import to_epoch
+
+
+# (summary name, beacon attribute)
+AGGREGATE_FIELDS = (
+    ('temp', 'val_temp'),
+    ('humi', 'val_humi'),
+    ('light', 'val_light'),
+    ('uv', 'val_uv'),
+    ('pressure', 'val_pressure'),
+    ('noise', 'val_noise'),
+    ('di', 'val_di'),
+    ('heat', 'val_heat'),
+    ('battery', 'val_battery'),
+    ('rssi', 'rssi'),
+)
+
+_values = operator.attrgetter(*[attr for _, attr in AGGREGATE_FIELDS])
+
+
+class Pane(object):
+    # running count / min / max / sum / last of every field over `step` s
+    __slots__ = ('start', 'count', 'min', 'max', 'sum', 'last')
+
+    def __init__(self, start, values):
+        self.start = start
+        self.count = 1
+        self.min = list(values)
+        self.max = list(values)
+        self.sum = list(values)
+        self.last = values
+
+    def add(self, values):
+        self.count += 1
+        mins, maxs, sums = self.min, self.max, self.sum
+        for i, v in enumerate(values):
+            if v < mins[i]:
+                mins[i] = v
+            elif v > maxs[i]:
+                maxs[i] = v
+            sums[i] += v
+        self.last = values
+
+
+class _Device(object):
+    __slots__ = ('panes', 'sensor_type', 'gateway', 'emitted')
+
+    def __init__(self, sensor_beacon):
+        self.panes = collections.deque()
+        # end of the last window summarized, so no window goes out twice
+        self.emitted = None
+        self.sensor_type = sensor_beacon.sensor_type
+        self.gateway = sensor_beacon.gateway
+
+
+class WindowAggregator(object):
+    """
+    window and step in seconds, aligned to the epoch. Each summary is a
+    dict with address, sensor_type, gateway, start, end (datetimes), count
+    and one {count, min, max, mean, last} dict per field. Summaries go to
+    on_summary and are also returned by add() / flush().
+    """
+
+    def __init__(self, window=60, step=None, on_summary=None):
+        if step is None:
+            step = window
+        if window % step:
+            raise ValueError('window must be a multiple of step')
+        self.window = window
+        self.step = step
+        self.on_summary = on_summary
+        self.devices = {}
+        self.readings = 0
+        self.summaries = 0
+
+    def add(self, sensor_beacon):
+        t = to_epoch(sensor_beacon.tick_last_update)
+        start = t // self.step * self.step
+        values = _values(sensor_beacon)
+        self.readings += 1
+
+        device = self.devices.get(sensor_beacon.bt_address)
+        if device is None:
+            device = self.devices[sensor_beacon.bt_address] = \
+                _Device(sensor_beacon)
+        device.sensor_type = sensor_beacon.sensor_type
+        device.gateway = sensor_beacon.gateway
+
+        panes = device.panes
+        if panes and panes[-1].start == start:
+            panes[-1].add(values)
+            return []
+        if panes and start < panes[-1].start:
+            # late reading; counted in the newest pane
+            panes[-1].add(values)
+            return []
+        summaries = self._advance(sensor_beacon.bt_address, device, start)
+        panes.append(Pane(start, values))
+        return summaries
+
+    __call__ = add
+
+    def flush(self, now=None):
+        """
+        Emit every window that has ended by `now` (datetime or epoch
+        seconds, default the current time); devices without pending
+        readings are dropped.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        boundary = to_epoch(now) // self.step * self.step
+        summaries = []
+        for address, device in list(self.devices.items()):
+            summaries.extend(self._advance(address, device, boundary))
+            if not device.panes:
+                del self.devices[address]
+        return summaries
+
+    def close(self):
+        # emit all remaining windows, complete or not
+        newest = max([d.panes[-1].start for d in self.devices.values()
+                      if d.panes] or [0])
+        return self.flush(newest + self.window + self.step)
+
+    def _advance(self, address, device, start):
+        # close windows ending at pane boundaries up to `start`
+        panes = device.panes
+        summaries = []
+        if panes:
+            end = panes[-1].start + self.step
+            if device.emitted is not None:
+                end = max(end, device.emitted + self.step)
+            last_end = min(start, panes[-1].start + self.window)
+            while end <= last_end:
+                summary = self._summarize(address, device, end)
+                if summary is not None:
+                    summaries.append(summary)
+                device.emitted = end
+                end += self.step
+        while panes and panes[0].start < start + self.step - self.window:
+            panes.popleft()
+        for summary in summaries:
+            self.summaries += 1
+            if self.on_summary is not None:
+                self.on_summary(summary)
+        return summaries
+
+    def _summarize(self, address, device, end):
+        begin = end - self.window
+        panes = [p for p in device.panes if begin <= p.start < end]
+        if not panes:
+            return None
+        count = sum(p.count for p in panes)
+        summary = {
+            'address': address,
+            'sensor_type': device.sensor_type,
+            'gateway': device.gateway,
+            'start': datetime.datetime.fromtimestamp(begin),
+            'end': datetime.datetime.fromtimestamp(end),
+            'count': count,
+        }
+        for i, (name, _) in enumerate(AGGREGATE_FIELDS):
+            summary[name] = {
+                'count': count,
+                'min': min(p.min[i] for p in panes),
+                'max': max(p.max[i] for p in panes),
+                'mean': sum(p.sum[i] for p in panes) / float(count),
+                'last': panes[-1].last[i],
+            }
+        return summary
@@ -0,0 +1,83 @@
+"""
+asyncio scanning backend
+
+The HCI socket is registered with the event loop's reader callbacks, so
+scanning, aggregation and upload can share one thread:
+
+    async for beacon in sensor.stream():
+        ...
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import asyncio
+import errno
+
+
+class _Failure(object):
+    # queued in place of a message when the reader callback failed
+
+    def __init__(self, error):
+        self.error = error
+
+
+async def stream(ble, maxsize=0):
+    """
+    Yield every message decoded by ble.decode as frames arrive.
+
+    Up to maxsize messages (0 = unbounded) are buffered between the reader
+    callback and the consumer; when the buffer is full new messages are
+    dropped and counted in ble.stream_dropped. Cancelling the consuming task
+    or closing the iterator unregisters the socket from the loop. Receive
+    and decode errors unregister it too and are raised in the consumer;
+    the end of a replayed capture ends the iteration.
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(maxsize)
+    if ble.sock is None:
+        ble.open()
+    sock = ble.sock
+    sock.setblocking(False)
+    fd = sock.fileno()
+    ble.stream_dropped = 0
+
+    def fail(error):
+        # hand the error to the consumer; it must not be dropped
+        loop.remove_reader(fd)
+        if queue.full():
+            queue.get_nowait()
+            ble.stream_dropped += 1
+        queue.put_nowait(_Failure(error))
+
+    def on_readable():
+        try:
+            pkt = sock.recv(255)
+            messages = ble.decode(pkt)
+        except (OSError, IOError) as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            fail(e)
+            return
+        except Exception as e:
+            fail(e)
+            return
+        for r in messages:
+            try:
+                queue.put_nowait(r)
+            except asyncio.QueueFull:
+                ble.stream_dropped += 1
+
+    loop.add_reader(fd, on_readable)
+    try:
+        while True:
+            r = await queue.get()
+            if isinstance(r, _Failure):
+                if isinstance(r.error, EOFError):
+                    return
+                raise r.error
+            yield r
+    finally:
+        loop.remove_reader(fd)
+        sock.setblocking(True)
@@ -0,0 +1,294 @@
+"""
+append-only binary archive of readings
+
+ArchiveSink appends one fixed-width record per beacon and keeps a sidecar
+index (<path>.idx) of the record range of every time block. The reader
+memory-maps the archive and answers "sensor X between T1 and T2" by
+scanning only the blocks overlapping T1..T2 (records of all devices are
+interleaved within a block), and returns NumPy arrays (numpy is needed for
+reading only).
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import binascii
+import mmap
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .sensorbeacon import raw_fields, BEACON_MEASURED_POWER
+from .util import to_epoch
+
+
+ARCHIVE_MAGIC = b'OMRONARC'
+ARCHIVE_VERSION = 1
+# magic, version, record size, block seconds
+ARCHIVE_HEADER = struct.Struct("<8sHHI")
+# timestamp (us since the epoch), address, sensor type, seq, temp, humi,
+# light, uv, pressure, noise, accel x / di, accel y / heat, accel z,
+# battery, rssi
+ARCHIVE_RECORD = struct.Struct("<q6sBBhHHHHHhhhBb")
+# block start (s since the epoch), first record, end record
+INDEX_ENTRY = struct.Struct("<qII")
+
+SENSOR_TYPES = {"UNKNOWN": 0, "IM": 1, "EP": 2}
+SENSOR_TYPE_NAMES = dict((v, k) for k, v in SENSOR_TYPES.items())
+
+
+def _pack_address(bt_address):
+    return binascii.unhexlify(bt_address.replace(':', ''))
+
+
+def _truncate(path, offset, entry_size):
+    # drop a partial trailing entry (power loss mid write) so that appended
+    # entries stay aligned
+    size = os.path.getsize(path)
+    usable = offset + max(size - offset, 0) // entry_size * entry_size
+    if usable != size:
+        logger.warning('%s: dropping %d bytes of a partial entry',
+                       path, size - usable)
+        with open(path, 'r+b') as f:
+            f.truncate(usable)
+
+
+class ArchiveSink(object):
+    """
+    Append beacons to `path`; callable, so usable as on_message.
+
+    Index entries for a time block of block_seconds are written when the
+    block is over (and on close()); records of the open block are found by
+    the reader scanning the unindexed tail.
+    """
+
+    def __init__(self, path, block_seconds=3600):
+        self.path = path
+        self.index_path = path + '.idx'
+        exists = os.path.exists(path) and \
+            os.path.getsize(path) >= ARCHIVE_HEADER.size
+        if exists:
+            with open(path, 'rb') as f:
+                _, _, _, block_seconds = _read_header(f)
+            _truncate(path, ARCHIVE_HEADER.size, ARCHIVE_RECORD.size)
+        self.block_seconds = block_seconds
+        self.file = open(path, 'ab' if exists else 'wb')
+        if not exists:
+            self.file.write(ARCHIVE_HEADER.pack(
+                ARCHIVE_MAGIC, ARCHIVE_VERSION, ARCHIVE_RECORD.size,
+                block_seconds))
+
+        self.count = (self.file.tell() - ARCHIVE_HEADER.size) // \
+            ARCHIVE_RECORD.size
+        indexed = self._repair_index() if exists else 0
+        self.index = open(self.index_path, 'ab' if exists else 'wb')
+        self.block = None
+        self.first = None
+        if exists:
+            self._recover_block(indexed)
+
+    def _repair_index(self):
+        # keep whole entries that point at existing records only; returns
+        # the number of records covered
+        if not os.path.exists(self.index_path):
+            return 0
+        _truncate(self.index_path, 0, INDEX_ENTRY.size)
+        entries = list(_read_index(self.index_path))
+        valid = [e for e in entries if e[2] <= self.count]
+        if len(valid) != len(entries):
+            with open(self.index_path, 'wb') as f:
+                for entry in valid:
+                    f.write(INDEX_ENTRY.pack(*entry))
+        return max([end for _, _, end in valid] or [0])
+
+    def _recover_block(self, indexed):
+        # rebuild the open block from records written after the last index
+        # entry by a previous writer
+        with open(self.path, 'rb') as f:
+            f.seek(ARCHIVE_HEADER.size + indexed * ARCHIVE_RECORD.size)
+            for n in range(indexed, self.count):
+                timestamp, = struct.unpack_from(
+                    "<q", f.read(ARCHIVE_RECORD.size))
+                self._add_to_block(n, timestamp)
+
+    def _add_to_block(self, n, timestamp):
+        block = timestamp // 1000000 // self.block_seconds * self.block_seconds
+        if block != self.block:
+            self._write_index(n)
+            self.block = block
+            self.first = n
+
+    def _write_index(self, end):
+        if self.first is not None and end > self.first:
+            self.index.write(INDEX_ENTRY.pack(self.block, self.first, end))
+        self.first = None
+
+    def write(self, sensor_beacon):
+        timestamp = int(round(to_epoch(sensor_beacon.tick_last_update) * 1000000))
+        address = _pack_address(sensor_beacon.bt_address)
+        self.file.write(ARCHIVE_RECORD.pack(
+            timestamp, address, SENSOR_TYPES.get(sensor_beacon.sensor_type, 0),
+            *raw_fields(sensor_beacon)))
+        self._add_to_block(self.count, timestamp)
+        self.count += 1
+
+    __call__ = write
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self._write_index(self.count)
+        self.file.close()
+        self.index.close()
+
+
+def _read_header(f):
+    magic, version, record_size, block_seconds = ARCHIVE_HEADER.unpack(
+        f.read(ARCHIVE_HEADER.size))
+    if magic != ARCHIVE_MAGIC or record_size != ARCHIVE_RECORD.size:
+        raise ValueError('not an omron_envsensor archive')
+    return magic, version, record_size, block_seconds
+
+
+def _read_index(index_path):
+    if not os.path.exists(index_path):
+        return
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_ENTRY.size
+    for offset in range(0, usable, INDEX_ENTRY.size):
+        yield INDEX_ENTRY.unpack_from(data, offset)
+
+
+class ArchiveReader(object):
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('reading archives requires numpy')
+        self.dtype = np.dtype([
+            ('timestamp', '<i8'), ('address', 'S6'), ('sensor_type', 'u1'),
+            ('seq_num', 'u1'), ('temp', '<i2'), ('humi', '<u2'),
+            ('light', '<u2'), ('uv', '<u2'), ('pressure', '<u2'),
+            ('noise', '<u2'), ('x', '<i2'), ('y', '<i2'), ('z', '<i2'),
+            ('battery', 'u1'), ('rssi', 'i1')])
+        assert self.dtype.itemsize == ARCHIVE_RECORD.size
+        self.file = open(path, 'rb')
+        _, _, _, self.block_seconds = _read_header(self.file)
+        size = os.path.getsize(path)
+        count = (size - ARCHIVE_HEADER.size) // ARCHIVE_RECORD.size
+        self.mmap = None
+        if count:
+            self.mmap = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            self.records = np.frombuffer(
+                self.mmap, dtype=self.dtype, count=count,
+                offset=ARCHIVE_HEADER.size)
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+        # block -> [(first, end), ...]; a block gets more than one span when
+        # a sink is reopened or the clock steps back into it
+        self.index = {}
+        self.indexed = 0
+        for block, first, end in _read_index(path + '.idx'):
+            if end > count:
+                continue
+            self.index.setdefault(block, []).append((first, end))
+            self.indexed = max(self.indexed, end)
+
+    def __len__(self):
+        return len(self.records)
+
+    def addresses(self):
+        found = set(self.records['address'].tolist())
+        return sorted(binascii.hexlify(a).decode('ascii').upper()
+                      for a in found)
+
+    def query(self, bt_address=None, start=None, end=None):
+        """
+        Raw records of one device (all when None) with start <= time < end,
+        as a structured array in archive order.
+        """
+        address = None if bt_address is None else _pack_address(bt_address)
+        t0 = None if start is None else int(to_epoch(start) * 1000000)
+        t1 = None if end is None else int(to_epoch(end) * 1000000)
+
+        ranges = []
+        for block, spans in self.index.items():
+            block_us = block * 1000000
+            if t1 is not None and block_us >= t1:
+                continue
+            if t0 is not None and \
+                    block_us + self.block_seconds * 1000000 <= t0:
+                continue
+            ranges.extend(spans)
+        ranges.append((self.indexed, len(self.records)))
+        # spans may overlap or touch, merge them
+        merged = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+
+        parts = []
+        for first, last in merged:
+            chunk = self.records[first:last]
+            mask = np.ones(len(chunk), dtype=bool)
+            if address is not None:
+                mask &= chunk['address'] == address
+            if t0 is not None:
+                mask &= chunk['timestamp'] >= t0
+            if t1 is not None:
+                mask &= chunk['timestamp'] < t1
+            parts.append(chunk[mask])
+        return np.concatenate(parts)
+
+    def columns(self, bt_address=None, start=None, end=None):
+        """
+        query() scaled like SensorBeacon, as a dict of arrays.
+        """
+        from .batch import discomfort_index_approximation, \
+            wbgt_approximation, return_accuracy
+        records = self.query(bt_address, start, end)
+        is_im = records['sensor_type'] == SENSOR_TYPES['IM']
+        is_ep = records['sensor_type'] == SENSOR_TYPES['EP']
+        temp = records['temp'] / 100.0
+        humi = records['humi'] / 100.0
+        x = records['x'].astype(np.float64)
+        y = records['y'].astype(np.float64)
+        return {
+            'timestamp': records['timestamp'] / 1000000.0,
+            'sensor_type': records['sensor_type'],
+            'seq_num': records['seq_num'].astype(np.int64),
+            'temp': temp,
+            'humi': humi,
+            'light': records['light'].astype(np.int64),
+            'uv': records['uv'] / 100.0,
+            'pressure': records['pressure'] / 10.0,
+            'noise': records['noise'] / 100.0,
+            'ax': np.where(is_im, x / 10.0, 0.0),
+            'ay': np.where(is_im, y / 10.0, 0.0),
+            'az': np.where(is_im, records['z'] / 10.0, 0.0),
+            'di': np.where(is_ep, x / 100.0,
+                           discomfort_index_approximation(temp, humi)),
+            'heat': np.where(is_ep, y / 100.0,
+                             wbgt_approximation(temp, humi)),
+            'battery': (records['battery'].astype(np.int64) + 100) * 10.0,
+            'rssi': records['rssi'].astype(np.int64),
+            'distance': return_accuracy(records['rssi'],
+                                        BEACON_MEASURED_POWER),
+        }
+
+    def close(self):
+        self.records = None
+        if self.mmap is not None:
+            self.mmap.close()
+        self.file.close()
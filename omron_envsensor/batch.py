@@ -0,0 +1,171 @@
+"""
+vectorized decoding of captured Omron payloads (requires numpy)
+
+Works on many payload_binary blobs at once and returns columnar arrays
+instead of one SensorBeacon per reading.
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import numpy as np
+
+from .ble import ADV_TYPE_MANUFACTURER_SPECIFIC_DATA, ADV_TYPE_SHORT_LOCAL_NAME
+from .sensorbeacon import COMPANY_ID, BEACON_MEASURED_POWER
+
+
+# payload_binary as built by _handle_le_advertising_report: 31 bytes of
+# advertising data followed by the rssi byte. Offsets match SensorBeacon.
+PAYLOAD_DTYPE = np.dtype([
+    ('flags', 'u1', (4,)),
+    ('ad_type', 'u1'),
+    ('company_id', '<u2'),
+    ('seq_num', 'u1'),
+    ('temp', '<i2'),
+    ('humi', '<u2'),
+    ('light', '<u2'),
+    ('uv', '<u2'),
+    ('pressure', '<u2'),
+    ('noise', '<u2'),
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('z', '<i2'),
+    ('battery', 'u1'),
+    ('name_length', 'u1'),
+    ('name_type', 'u1'),
+    ('name', 'S2'),
+    ('rssi', 'i1'),
+])
+
+# the same layout without the trailing rssi byte
+DATA_DTYPE = np.dtype({
+    'names': PAYLOAD_DTYPE.names[:-1],
+    'formats': [PAYLOAD_DTYPE.fields[name][0]
+                for name in PAYLOAD_DTYPE.names[:-1]],
+    'offsets': [PAYLOAD_DTYPE.fields[name][1]
+                for name in PAYLOAD_DTYPE.names[:-1]],
+    'itemsize': PAYLOAD_DTYPE.itemsize - 1,
+})
+
+
+def discomfort_index_approximation(temp, humi):
+    # vectorized sensorbeacon.discomfort_index_approximation
+    return (0.81 * temp) + 0.01 * humi * ((0.99 * temp) - 14.3) + 46.3
+
+
+def wbgt_approximation(temp, humi, flag_outside=False):
+    # vectorized sensorbeacon.wbgt_approximation
+    temp = np.maximum(temp, 0)
+    humi = np.clip(humi, 0, 100)
+    wbgt = (0.567 * temp) + 0.393 * (
+        humi / 100 * 6.105 * np.exp(
+            17.27 * temp / (237.7 + temp))) + 3.94
+    if not flag_outside:
+        wbgt = (wbgt + (1.1 * (1 - (humi / 62) * 1.6)) * (temp - 30) *
+                0.17 - np.abs(temp - 30) * 0.09) / 1.135
+    return wbgt
+
+
+def return_accuracy(rssi, power=BEACON_MEASURED_POWER):
+    # vectorized SensorBeacon.return_accuracy, rough distance in meter
+    rssi = np.abs(np.asarray(rssi, dtype=np.float64))
+    if power == 0:
+        return np.full(rssi.shape, -1.0)
+    ratio = rssi / abs(power)
+    accuracy = np.where(ratio < 1.0, np.power(ratio, 8.0),
+                        0.69976 * np.power(ratio, 7.7095) + 0.111)
+    return np.where(rssi == 0, -1.0, accuracy)
+
+
+def _usable(payloads):
+    # payload_binary blobs of a length as_records can view
+    return [p for p in payloads
+            if len(p) in (PAYLOAD_DTYPE.itemsize, DATA_DTYPE.itemsize)]
+
+
+def as_records(payloads):
+    """
+    View payloads as a structured array.
+
+    payloads is a sequence of payload_binary blobs (32 bytes with rssi, or
+    31 bytes without) or one contiguous buffer of 32 byte records.
+    Blobs of any other length are dropped. When both lengths are present
+    the 31 byte blobs are padded to 32 with an rssi of 0.
+    """
+    if isinstance(payloads, (bytes, bytearray, memoryview)):
+        return np.frombuffer(payloads, dtype=PAYLOAD_DTYPE)
+    if isinstance(payloads, np.ndarray) and payloads.dtype.fields:
+        return payloads
+
+    payloads = _usable(payloads)
+    if any(len(p) == PAYLOAD_DTYPE.itemsize for p in payloads):
+        return np.frombuffer(b''.join(
+            bytes(p) if len(p) == PAYLOAD_DTYPE.itemsize else bytes(p) + b'\0'
+            for p in payloads), dtype=PAYLOAD_DTYPE)
+    return np.frombuffer(b''.join(bytes(p) for p in payloads),
+                         dtype=DATA_DTYPE)
+
+
+def verify(records):
+    # vectorized sensorbeacon.verify_beacon_packet
+    return (records['ad_type'] == ADV_TYPE_MANUFACTURER_SPECIFIC_DATA) & \
+        (records['company_id'] == COMPANY_ID) & \
+        (records['name_type'] == ADV_TYPE_SHORT_LOCAL_NAME) & \
+        ((records['name'] == b'IM') | (records['name'] == b'EP'))
+
+
+def decode_payloads(payloads, drop_invalid=True):
+    """
+    Decode many Omron payloads in one pass.
+
+    Returns a dict of equally sized arrays: sensor_type, seq_num, temp,
+    humi, light, uv, pressure, noise, ax, ay, az, di, heat, battery, and
+    rssi / distance when the payloads carry the rssi byte. Values are scaled
+    exactly as in SensorBeacon. When only some blobs carry the rssi byte,
+    rssi and distance are float arrays with NaN for the others.
+    """
+    has_rssi = None
+    if not isinstance(payloads, (bytes, bytearray, memoryview, np.ndarray)):
+        payloads = _usable(payloads)
+        has_rssi = np.array(
+            [len(p) == PAYLOAD_DTYPE.itemsize for p in payloads], dtype=bool)
+    records = as_records(payloads)
+    if drop_invalid:
+        valid = verify(records)
+        records = records[valid]
+        if has_rssi is not None:
+            has_rssi = has_rssi[valid]
+
+    is_im = records['name'] == b'IM'
+    is_ep = records['name'] == b'EP'
+    temp = records['temp'] / 100.0
+    humi = records['humi'] / 100.0
+    x = records['x'].astype(np.float64)
+    y = records['y'].astype(np.float64)
+    z = records['z'].astype(np.float64)
+
+    result = {
+        'sensor_type': records['name'].astype('U2'),
+        'seq_num': records['seq_num'].astype(np.int64),
+        'temp': temp,
+        'humi': humi,
+        'light': records['light'].astype(np.int64),
+        'uv': records['uv'] / 100.0,
+        'pressure': records['pressure'] / 10.0,
+        'noise': records['noise'] / 100.0,
+        'ax': np.where(is_im, x / 10.0, 0.0),
+        'ay': np.where(is_im, y / 10.0, 0.0),
+        'az': np.where(is_im, z / 10.0, 0.0),
+        'di': np.where(is_ep, x / 100.0,
+                       discomfort_index_approximation(temp, humi)),
+        'heat': np.where(is_ep, y / 100.0, wbgt_approximation(temp, humi)),
+        'battery': (records['battery'].astype(np.int64) + 100) * 10.0,
+    }
+    if 'rssi' in records.dtype.names:
+        rssi = records['rssi'].astype(np.int64)
+        if has_rssi is not None and not has_rssi.all():
+            rssi = np.where(has_rssi, rssi, np.nan)
+        result['rssi'] = rssi
+        result['distance'] = return_accuracy(rssi)
+    return result
@@ -5,13 +5,24 @@ logger = getLogger(__name__)
 
 __version__ = '0.0.0'
 
-import sys
-import bluetooth._bluetooth as bluez
+import binascii
+import errno
+import socket
+import threading
 import struct
 from . import util
 from .exception import NoCallBackException
 
 
+# largest HCI event frame: packet type, event code, length, 255 parameters
+HCI_MAX_FRAME_SIZE = 258
+
+# HCI packet types and the raw socket filter option (linux/hci.h).
+HCI_COMMAND_PKT = 0x01
+HCI_EVENT_PKT = 0x04
+SOL_HCI = 0
+HCI_FILTER = 2
+
 # BLE OpCode group field for the LE related OpCodes.
 OGF_LE_CTL = 0x08
 
@@ -47,6 +58,15 @@ OCF_LE_RECEIVER_TEST = 0x001D
 OCF_LE_TRANSMITTER_TEST = 0x001E
 OCF_LE_TEST_END = 0x001F
 
+# HCI events handled by hci_le_parse_response_packet.
+EVT_INQUIRY_COMPLETE = 0x01
+EVT_INQUIRY_RESULT = 0x02
+EVT_DISCONN_COMPLETE = 0x05
+EVT_CMD_COMPLETE = 0x0E
+EVT_CMD_STATUS = 0x0F
+EVT_NUM_COMP_PKTS = 0x13
+EVT_INQUIRY_RESULT_WITH_RSSI = 0x22
+
 # BLE events; all LE commands result in a metaevent, specified by the subevent
 # code below.
 EVT_LE_META_EVENT = 0x3E
@@ -164,69 +184,377 @@ ADV_TYPE_APPEARANCE = 0x19
 ADV_TYPE_MANUFACTURER_SPECIFIC_DATA = 0xFF
 
 
+HCI_COMMAND = struct.Struct("<BHB")
+# type_mask, event_mask[2], opcode
+HCI_FILTER_STRUCT = struct.Struct("<IIIH")
+
+# event layouts for hci_le_parse_response_packet
+HCI_EVENT_HEADER = struct.Struct("<BBB")
+UINT8 = struct.Struct("<B")
+RSSI = struct.Struct("<b")
+BDADDR = struct.Struct("<6B")
+BDADDR_FORMAT = ":".join(["%02X"] * 6)
+COMPLETED_PACKETS = struct.Struct("<HH")
+DISCONN_COMPLETE = struct.Struct("<BHB")
+COMMAND_STATUS = struct.Struct("<BBH")
+COMMAND_COMPLETE = struct.Struct("<BH")
+LE_CONN_COMPLETE = struct.Struct("<BHBB6sHHHB")
+LE_CONN_UPDATE_COMPLETE = struct.Struct("<BHHHH")
+LE_REMOTE_USED_FEATURES = struct.Struct("<BH8B")
+LE_LTK_REQUEST = struct.Struct("<H8sH")
+# event type, address type; then address and data length (9 bytes in all)
+ADV_REPORT_TYPES = struct.Struct("<BB")
+ADV_REPORT_FIXED = 9
+
+
 class BLE(object):
     on_message = None
+    sock = None
+    # dispatch.Dispatcher; when set, on_message runs on its worker threads
+    dispatcher = None
+    # frames drained per wakeup by loop(); 1 keeps one recv per frame
+    batch_size = 1
+    # SO_RCVBUF for the HCI socket in bytes, None keeps the kernel default
+    rcvbuf = None
+    # object whose open(ble) returns the socket, BluezTransport when None;
+    # see btsnoop for capture recording and replay
+    transport = None
+    # instrument.PipelineStats; None keeps the receive loop uninstrumented
+    instrumentation = None
+    # render packet_str / payload hex strings only when they are read
+    lazy_hex = False
+    # kernel socket filter passes LE meta events only instead of all events
+    le_meta_only = False
+    # bt addresses ("AA:BB:CC:DD:EE:FF", "AABBCCDDEEFF" as in
+    # beacon.bt_address, or (address, address type) pairs) loaded
+    # into the controller white list; scanning then reports only these
+    whitelist = None
+    # ScanProfile; None scans with ScanProfile() defaults
+    scan_profile = None
 
     def __init__(self, device_id):
         self.device_id = device_id
+        self._buffer = None
+        self.duty_cycle = None
 
     def init(self):
-        if self.on_message is None:
-            raise NoCallBackException('callback function is none. Please set self.on_message')
-
-        self.sock = deviceOpen(self.device_id)
-
-        hci_le_set_scan_parameters(self.sock)
-        hci_le_enable_scan(self.sock)
-
-        # preserve old filter setting
-        old_filter = self.sock.getsockopt(bluez.SOL_HCI,
-                                     bluez.HCI_FILTER, 14)
-
-        # perform a device inquiry on bluetooth device #0
-        # The inquiry should last 8 * 1.28 = 10.24 seconds
-        # before the inquiry is performed, bluez should flush its cache of
-        # previously discovered devices
-        flt = bluez.hci_filter_new()
-        bluez.hci_filter_all_events(flt)
-        bluez.hci_filter_set_ptype(flt, bluez.HCI_EVENT_PKT)
-        self.sock.setsockopt(bluez.SOL_HCI, bluez.HCI_FILTER, flt)
+        if self.on_message is None and self.dispatcher is None:
+            raise NoCallBackException('callback function is none. Please set self.on_message or self.dispatcher')
+
+        self.open()
+
+    def open(self):
+        # open the HCI socket (through self.transport) and start scanning
+        transport = self.transport
+        if transport is None:
+            transport = BluezTransport()
+        self.sock = transport.open(self)
+
+    def close(self):
+        # stop the duty cycle thread before closing the socket it writes to
+        if self.duty_cycle is not None:
+            self.duty_cycle.stop()
+            self.duty_cycle = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
 
     @staticmethod
     def filter(r):
         return r
 
+    def filter_all(self, result):
+        # every message carried by one HCI event
+        r = self.filter(result)
+        if r:
+            return [r]
+        return []
+
+    def decode(self, pkt):
+        if isinstance(pkt, memoryview):
+            # the parse result keeps references into pkt
+            pkt = pkt.tobytes()
+        if self.instrumentation is None:
+            result = hci_le_parse_response_packet(pkt, lazy_hex=self.lazy_hex)
+        else:
+            start = util.timer()
+            result = hci_le_parse_response_packet(pkt, lazy_hex=self.lazy_hex)
+            self.instrumentation.time('parse', util.timer() - start)
+        return self.filter_all(result)
+
     def _catchOne(self):
         pkt = self.sock.recv(255)
 
-        result = hci_le_parse_response_packet(pkt)
-        r = self.filter(result)
-        if r:
-            self.on_message(r)
+        deliver = self.dispatcher.put if self.dispatcher else self.on_message
+        for r in self.decode(pkt):
+            deliver(r)
+
+    def _recv_batch(self):
+        """
+        Block for one frame, then drain up to batch_size - 1 more without
+        blocking. Frames are memoryviews into a buffer reused on the next
+        call.
+        """
+        if self._buffer is None:
+            self._buffer = memoryview(
+                bytearray(HCI_MAX_FRAME_SIZE * self.batch_size))
+        recv_into = getattr(self.sock, 'recv_into', None)
+        frames = []
+        flags = 0
+        for offset in range(0, len(self._buffer), HCI_MAX_FRAME_SIZE):
+            buf = self._buffer[offset:offset + HCI_MAX_FRAME_SIZE]
+            try:
+                if recv_into is not None:
+                    n = recv_into(buf, HCI_MAX_FRAME_SIZE, flags)
+                    frames.append(buf[:n])
+                else:
+                    frames.append(self.sock.recv(HCI_MAX_FRAME_SIZE, flags))
+            except (OSError, IOError) as e:
+                if frames and e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            except EOFError:
+                # end of a replayed capture, deliver what was read first
+                if frames:
+                    break
+                raise
+            flags = socket.MSG_DONTWAIT
+        return frames
+
+    def _catchBatch(self):
+        deliver = self.dispatcher.put if self.dispatcher else self.on_message
+        for pkt in self._recv_batch():
+            for r in self.decode(pkt):
+                deliver(r)
+
+    def _catchInstrumented(self):
+        # _catchOne / _catchBatch timing every stage into self.instrumentation
+        stats = self.instrumentation
+        timer = util.timer
+        deliver = self.dispatcher.put if self.dispatcher else self.on_message
+        start = timer()
+        if self.batch_size > 1:
+            frames = self._recv_batch()
+        else:
+            frames = [self.sock.recv(255)]
+        stats.time('recv', timer() - start)
+
+        for pkt in frames:
+            stats.frame(pkt)
+            start = timer()
+            messages = self.decode(pkt)
+            stats.time('decode', timer() - start)
+            for r in messages:
+                start = timer()
+                deliver(r)
+                stats.time('callback', timer() - start)
+            stats.messages += len(messages)
+        stats.tick()
+
+    def stats(self):
+        # snapshot of self.instrumentation, empty when not instrumented
+        if self.instrumentation is None:
+            return {}
+        return self.instrumentation.snapshot()
+
+    def stream(self, maxsize=0):
+        """
+        Async iterator of decoded messages for use inside an asyncio loop,
+        see aio.stream. Opens the socket if init() was not called.
+        """
+        from .aio import stream
+        return stream(self, maxsize)
 
     def loop(self):
+        if self.instrumentation is not None:
+            catch = self._catchInstrumented
+        elif self.batch_size > 1:
+            catch = self._catchBatch
+        else:
+            catch = self._catchOne
         self.loop = True
-        while self.loop:
-            self._catchOne()
+        try:
+            while self.loop:
+                catch()
+        except EOFError:
+            # end of a replayed capture
+            pass
+
+
+# linux/socket.h and bluetooth.h; not every Python build defines them
+AF_BLUETOOTH = getattr(socket, 'AF_BLUETOOTH', 31)
+BTPROTO_HCI = getattr(socket, 'BTPROTO_HCI', 1)
+
+
+def native_socket(sock):
+    """
+    Standard library socket on a dup of sock's fd. pybluez sockets have no
+    recv_into, so without this every batched frame is a new bytes object.
+    Falls back to sock itself when the fd can't be wrapped.
+    """
+    try:
+        native = socket.fromfd(sock.fileno(), AF_BLUETOOTH, socket.SOCK_RAW,
+                               BTPROTO_HCI)
+    except (AttributeError, OSError, IOError, ValueError) as e:
+        logger.debug('keeping the pybluez socket: %s', e)
+        return sock
+    sock.close()
+    return native
+
+
+class BluezTransport(object):
+    # live HCI socket of adapter ble.device_id
+
+    def open(self, ble):
+        sock = native_socket(deviceOpen(ble.device_id))
+        if ble.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ble.rcvbuf)
+        self.setup(sock, ble)
+        return sock
+
+    def setup(self, sock, ble):
+        # scan commands and socket filter; sock only needs send/setsockopt
+        filter_type = LE_FILTER_ALLOW_ALL
+        if ble.whitelist:
+            # the white list can't change while a white list scan runs
+            hci_le_disable_scan(sock)
+            hci_le_clear_white_list(sock)
+            for entry in ble.whitelist:
+                if isinstance(entry, tuple):
+                    hci_le_add_device_to_white_list(sock, *entry)
+                else:
+                    hci_le_add_device_to_white_list(sock, entry)
+            filter_type = LE_FILTER_WHITELIST_ONLY
+
+        profile = ble.scan_profile or ScanProfile()
+        hci_le_set_scan_parameters(sock, profile.scan_type, profile.interval,
+                                   profile.window, profile.own_bdaddr_type,
+                                   filter_type)
+        hci_le_enable_scan(sock, profile.filter_duplicates)
+        if profile.off_time:
+            ble.duty_cycle = DutyCycle(sock, profile)
+            ble.duty_cycle.start()
+
+        events = (EVT_LE_META_EVENT,) if ble.le_meta_only else None
+        sock.setsockopt(SOL_HCI, HCI_FILTER, hci_event_filter(events))
+
+
+class ScanProfile(object):
+    """
+    LE scan settings. interval and window are in 0.625 ms units
+    (0x0004-0x4000, window <= interval). With filter_duplicates the
+    controller reports each address once per scan enable, so it is only
+    useful together with a duty cycle: on_time seconds scanning, then
+    off_time seconds with the scan disabled.
+    """
+
+    def __init__(self, scan_type=LE_SCAN_ACTIVE, interval=0x10, window=0x10,
+                 filter_duplicates=False, on_time=None, off_time=None,
+                 own_bdaddr_type=LE_RANDOM_ADDRESS):
+        if not 0x0004 <= window <= interval <= 0x4000:
+            raise ValueError('need 0x0004 <= window <= interval <= 0x4000')
+        if bool(on_time) != bool(off_time):
+            raise ValueError('duty cycle needs both on_time and off_time')
+        self.scan_type = scan_type
+        self.interval = interval
+        self.window = window
+        self.filter_duplicates = filter_duplicates
+        self.on_time = on_time
+        self.off_time = off_time
+        self.own_bdaddr_type = own_bdaddr_type
+
+    @staticmethod
+    def units(ms):
+        # milliseconds to 0.625 ms scan timing units
+        return int(round(ms / 0.625))
+
+
+class DutyCycle(object):
+    # toggles scanning on sock from a daemon thread; recv just idles while off
+
+    def __init__(self, sock, profile):
+        self.sock = sock
+        self.profile = profile
+        self.cycles = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        profile = self.profile
+        while not self._stop.wait(profile.on_time):
+            hci_le_disable_scan(self.sock)
+            if self._stop.wait(profile.off_time):
+                break
+            hci_le_enable_scan(self.sock, profile.filter_duplicates)
+            self.cycles += 1
 
 
 def deviceOpen(deviceId):
+    # pybluez is only needed for live sockets; parsing works without it
+    import bluetooth._bluetooth as bluez
     return bluez.hci_open_dev(deviceId)
 
 
+def hci_send_cmd(sock, ogf, ocf, params=b''):
+    # same bytes bluez.hci_send_cmd writes: packet type, opcode, length
+    sock.send(HCI_COMMAND.pack(HCI_COMMAND_PKT, (ogf << 10) | ocf,
+                               len(params)) + params)
+
+
+def hci_event_filter(events=None):
+    """
+    struct hci_filter for event packets; events is an iterable of event
+    codes, None passes every event.
+    """
+    if events is None:
+        mask = [0xFFFFFFFF, 0xFFFFFFFF]
+    else:
+        mask = [0, 0]
+        for event in events:
+            mask[event >> 5] |= 1 << (event & 31)
+    return HCI_FILTER_STRUCT.pack(1 << HCI_EVENT_PKT, mask[0], mask[1], 0)
+
+
+def bdaddr_from_str(address):
+    # "AA:BB:CC:DD:EE:FF" or beacon.bt_address "AABBCCDDEEFF" to the
+    # little endian bdaddr_t
+    return binascii.unhexlify(address.replace(':', ''))[::-1]
+
+
+def hci_le_clear_white_list(sock):
+    hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_CLEAR_WHITE_LIST)
+
+
+def hci_le_add_device_to_white_list(sock, address,
+                                    address_type=LE_RANDOM_ADDRESS):
+    # controllers hold only a few entries (often 8 to 128); extra ones fail
+    cmd_pkt = struct.pack("<B6s", address_type, bdaddr_from_str(address))
+    hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_ADD_DEVICE_TO_WHITE_LIST, cmd_pkt)
+
+
 def hci_le_set_scan_parameters(sock, scan_type=LE_SCAN_ACTIVE, interval=0x10,
                                window=0x10, own_bdaddr_type=LE_RANDOM_ADDRESS,
                                filter_type=LE_FILTER_ALLOW_ALL):
     # setting up scan
 
-    # interval and window are uint_16, so we pad them with 0x0
-    cmd_pkt = struct.pack("<BBBBBBB", scan_type, 0x0, interval, 0x0, window, own_bdaddr_type, filter_type)
-    bluez.hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_SET_SCAN_PARAMETERS, cmd_pkt)
+    # interval and window are uint_16
+    cmd_pkt = struct.pack("<BHHBB", scan_type, interval, window, own_bdaddr_type, filter_type)
+    hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_SET_SCAN_PARAMETERS, cmd_pkt)
     # sent scan parameters command
 
 
-def hci_le_enable_scan(sock):
-    hci_le_toggle_scan(sock, 0x01)
+def hci_le_enable_scan(sock, filter_duplicates=False):
+    hci_le_toggle_scan(sock, 0x01, filter_duplicates)
 
 
 def hci_le_disable_scan(sock):
@@ -243,165 +571,103 @@ def ogf_and_ocf_from_opcode(opcode):
     ocf = opcode & 0x03FF
     return (ogf, ocf)
 
-def hci_le_toggle_scan(sock, enable):
+def hci_le_toggle_scan(sock, enable, filter_duplicates=False):
     # toggle scan
-    cmd_pkt = struct.pack("<BB", enable, 0x00)
-    bluez.hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_SET_SCAN_ENABLE, cmd_pkt)
+    cmd_pkt = struct.pack("<BB", enable, LE_FILTER_DUPLICATES_ON
+                          if filter_duplicates else LE_FILTER_DUPLICATES_OFF)
+    hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_SET_SCAN_ENABLE, cmd_pkt)
     # sent toggle command"
 
-def hci_le_parse_response_packet(pkt):
+def hci_le_parse_response_packet(pkt, lazy_hex=False):
     """
     Parse a BLE packet.
 
     Returns a dictionary which contains the event id, length and packet type,
     and possibly additional key/value pairs that represent the parsed content
     of the packet.
+
+    With lazy_hex the debug hex strings ("packet_str" and each report's
+    "payload") are only built when they are read.
     """
-    result = {}
-    ptype, event, plen = struct.unpack("<BBB", pkt[:3])
+    if lazy_hex:
+        result = util.LazyHexDict()
+    else:
+        result = {}
+    view = memoryview(pkt)
+    ptype, event, plen = HCI_EVENT_HEADER.unpack_from(view)
     result["packet_type"] = ptype
     result["bluetooth_event_id"] = event
     result["packet_length"] = plen
 
     # We give the user the full packet back as the packet is small, and
     # the user may have additional parsing they want to do.
-    result["packet_str"] = util.packet_as_hex_string(pkt, flag_with_spacing=True)
-    # result["packet_str"] = struct.unpack('<BBB', pkt[:3])
+    if lazy_hex:
+        result.defer_hex("packet_str", pkt, flag_with_spacing=True)
+    else:
+        result["packet_str"] = util.packet_as_hex_string(pkt, flag_with_spacing=True)
     result["packet_bin"] = pkt
 
-    payload = pkt[3:]
-
     # We only care about events that relate to BLE.
-    if event == EVT_LE_META_EVENT:
-        result["bluetooth_event_name"] = "EVT_LE_META_EVENT"
-        result.update(_handle_le_meta_event(pkt[3:]))
-
-    elif event == bluez.EVT_NUM_COMP_PKTS:
-        result["bluetooth_event_name"] = "EVT_NUM_COMP_PKTS"
-        result.update(_handle_num_completed_packets(pkt[3:]))
-
-    elif event == bluez.EVT_INQUIRY_RESULT_WITH_RSSI:
-        result["bluetooth_event_name"] = "EVT_INQUIRY_RESULT_WITH_RSSI"
-        result.update(_handle_inquiry_result_with_rssi(pkt[3:]))
-
-    elif event == bluez.EVT_INQUIRY_RESULT:
-        result["bluetooth_event_name"] = "EVT_INQUIRY_RESULT"
-        result.update(_handle_inquiry_result(pkt[3:]))
+    name, handler = EVENT_HANDLERS.get(event, _UNKNOWN)
+    result["bluetooth_event_name"] = name
+    if handler is not None:
+        handler(view, HCI_EVENT_HEADER.size, result, lazy_hex)
+    return result
 
-    elif event == bluez.EVT_DISCONN_COMPLETE:
-        result["bluetooth_event_name"] = "EVT_DISCONN_COMPLETE"
-        result.update(_handle_disconn_complete(pkt[3:]))
 
-    elif event == bluez.EVT_CMD_STATUS:
-        result["bluetooth_event_name"] = "EVT_CMD_STATUS"
-        result.update(_handle_command_status(pkt[3:]))
+def _bdaddr(view, offset):
+    # packed little endian bdaddr to "AA:BB:CC:DD:EE:FF"
+    return BDADDR_FORMAT % BDADDR.unpack_from(view, offset)[::-1]
 
-    elif event == bluez.EVT_CMD_COMPLETE:
-        result["bluetooth_event_name"] = "EVT_CMD_COMPLETE"
-        result.update(_handle_command_complete(pkt[3:]))
 
-    elif event == bluez.EVT_INQUIRY_COMPLETE:
-        raise NotImplementedError("EVT_CMD_COMPLETE")
+def _handle_inquiry_complete(view, offset, result, lazy_hex):
+    result["status"], = UINT8.unpack_from(view, offset)
 
-    else:
-        result["bluetooth_event_name"] = "UNKNOWN"
 
-    return result
-
-def _handle_num_completed_packets(pkt):
-    result = {}
-    num_connection_handles = struct.unpack("<B", pkt[0])[0]
-    pkt = pkt[1:]
+def _handle_num_completed_packets(view, offset, result, lazy_hex):
+    num_connection_handles, = UINT8.unpack_from(view, offset)
+    offset += UINT8.size
     result["num_connection_handles"] = num_connection_handles
-    result["handles"] = []
-    for i in xrange(num_connection_handles):
-        handle, = struct.unpack("<H", pkt[0:2])
-        completed_packets, = struct.unpack("<H", pkt[2:4])
-        result["handles"].append(
+    handles = result["handles"] = []
+    for i in range(num_connection_handles):
+        handle, completed_packets = COMPLETED_PACKETS.unpack_from(view, offset)
+        handles.append(
             {"handle": handle, "num_completed_packets": completed_packets})
-        pkt = pkt[4:]
-    return result
+        offset += COMPLETED_PACKETS.size
 
 
-def _handle_inquiry_result_with_rssi(pkt):
-    result = {}
-    num_inquiry_results = struct.unpack("B", pkt[0])[0]
-    pkt = pkt[1:]
+def _handle_inquiry_result(view, offset, result, lazy_hex):
+    # bdaddr[n], page scan repetition mode[n], reserved[2n],
+    # class of device[3n], clock offset[2n]
+    num_inquiry_results, = UINT8.unpack_from(view, offset)
+    offset += UINT8.size
     result["num_inquiry_results"] = num_inquiry_results
-    result["inquiry_results"] = []
-    for i in xrange(num_inquiry_results):
-        addr = bluez.ba2str(pkt[(6 * i):(6 * i) + 6])
-        rssi = struct.unpack("b", pkt[(13 * num_inquiry_results) + i])[0]
-        result["inquiry_results"].append({"Address": addr, "RSSI": rssi})
-    return result
-
-
-def _handle_inquiry_result(pkt):
-    result = {}
-    num_inquiry_results = struct.unpack("B", pkt[0])[0]
-    pkt = pkt[1:]
+    result["inquiry_results"] = [
+        {"Address": _bdaddr(view, offset + BDADDR.size * i)}
+        for i in range(num_inquiry_results)]
+
+
+def _handle_inquiry_result_with_rssi(view, offset, result, lazy_hex):
+    # bdaddr[n], page scan repetition mode[n], reserved[n],
+    # class of device[3n], clock offset[2n], rssi[n]
+    num_inquiry_results, = UINT8.unpack_from(view, offset)
+    offset += UINT8.size
+    rssi_offset = offset + 13 * num_inquiry_results
+    results = result["inquiry_results"] = []
     result["num_inquiry_results"] = num_inquiry_results
-    result["inquiry_results"] = []
-    for i in xrange(num_inquiry_results):
-        addr = bluez.ba2str(pkt[(6 * i):(6 * i) + 6])
-        result["inquiry_results"].append({"Address": addr})
-    return result
-
-    num_connection_handles = struct.unpack("<B", pkt[0])[0]
-    pkt = pkt[1:]
-    result["num_connection_handles"] = num_connection_handles
-    result["handles"] = []
-    for i in xrange(num_connection_handles):
-        handle, = struct.unpack("<H", pkt[0:2])
-        completed_packets, = struct.unpack("<H", pkt[2:4])
-        result["handles"].append(
-            {"handle": handle, "num_completed_packets": completed_packets})
-        pkt = pkt[4:]
-    return result
-
-
-def _handle_disconn_complete(pkt):
-    status, handle, reason = struct.unpack("<BHB", pkt)
-    return {"status": status, "handle": handle, "reason": reason}
-
-
-def _handle_le_meta_event(pkt):
-    result = {}
-
-    if sys.version < '3':
-        subevent, = struct.unpack("B", pkt[0])
-    else:
-        subevent = pkt[0]
-
-    result["bluetooth_le_subevent_id"] = subevent
-    payload = pkt[1:]
+    for i in range(num_inquiry_results):
+        results.append({
+            "Address": _bdaddr(view, offset + BDADDR.size * i),
+            "RSSI": RSSI.unpack_from(view, rssi_offset + i)[0]})
 
-    if subevent == EVT_LE_ADVERTISING_REPORT:
-        result["bluetooth_le_subevent_name"] = "EVT_LE_ADVERTISING_REPORT"
-        result.update(_handle_le_advertising_report(payload))
 
-    elif subevent == EVT_LE_CONN_COMPLETE:
-        result["bluetooth_le_subevent_name"] = "EVT_LE_CONN_COMPLETE"
-        result.update(_handle_le_connection_complete(payload))
+def _handle_disconn_complete(view, offset, result, lazy_hex):
+    result["status"], result["handle"], result["reason"] = \
+        DISCONN_COMPLETE.unpack_from(view, offset)
 
-    elif subevent == EVT_LE_CONN_UPDATE_COMPLETE:
-        result["bluetooth_le_subevent_name"] = "EVT_LE_CONN_UPDATE_COMPLETE"
-        raise NotImplementedError("EVT_LE_CONN_UPDATE_COMPLETE")
 
-    elif subevent == EVT_LE_READ_REMOTE_USED_FEATURES_COMPLETE:
-        result["bluetooth_le_subevent_name"] = \
-            "EVT_LE_READ_REMOTE_USED_FEATURES_COMPLETE"
-        result.update(_handle_le_read_remote_used_features(payload))
-
-    else:
-        result["bluetooth_le_subevent_name"] = "UNKNOWN"
-
-    return result
-
-
-def _handle_command_status(pkt):
-    result = {}
-    status, ncmd, opcode = struct.unpack("<BBH", str(pkt))
+def _handle_command_status(view, offset, result, lazy_hex):
+    status, ncmd, opcode = COMMAND_STATUS.unpack_from(view, offset)
     (ogf, ocf) = ogf_and_ocf_from_opcode(opcode)
     result["status"] = status
     result["number_of_commands"] = ncmd
@@ -409,166 +675,142 @@ def _handle_command_status(pkt):
     result["opcode_group_field"] = ogf
     result["opcode_command_field"] = ocf
 
-    return result
-
 
-def _handle_command_complete(pkt):
-    result = {}
-    ncmd, opcode = struct.unpack("<BH", pkt[:3])
+def _handle_command_complete(view, offset, result, lazy_hex):
+    ncmd, opcode = COMMAND_COMPLETE.unpack_from(view, offset)
     (ogf, ocf) = ogf_and_ocf_from_opcode(opcode)
     result["number_of_commands"] = ncmd
     result["opcode"] = opcode
     result["opcode_group_field"] = ogf
     result["opcode_command_field"] = ocf
-    result["command_return_values"] = ""
-
-    if len(pkt) > 3:
-        result["command_return_values"] = pkt[3:]
     # Since we only care about BLE commands, we ignore the command return
     # values here. A full-powered bluetooth parsing module would check the OCF
     # above and parse the return values based on that OCF. We return the return
     # values to the user should the used want to parse the return values.
-    return result
+    result["command_return_values"] = \
+        view[offset + COMMAND_COMPLETE.size:].tobytes()
 
 
-def _handle_le_connection_complete(pkt):
-    result = {}
-    status, handle, role, peer_bdaddr_type = struct.unpack("<BHBB", pkt[0:5])
-    device_address = util.packed_bdaddr_to_string(pkt[5:11])
-    interval, latency, supervision_timeout, master_clock_accuracy = struct.unpack("<HHHB", pkt[11:])
+def _handle_le_meta_event(view, offset, result, lazy_hex):
+    subevent, = UINT8.unpack_from(view, offset)
+    result["bluetooth_le_subevent_id"] = subevent
+    name, handler = LE_SUBEVENT_HANDLERS.get(subevent, _UNKNOWN)
+    result["bluetooth_le_subevent_name"] = name
+    if handler is not None:
+        handler(view, offset + UINT8.size, result, lazy_hex)
+
+
+def _handle_le_connection_complete(view, offset, result, lazy_hex):
+    (status, handle, role, peer_bdaddr_type, _, interval, latency,
+     supervision_timeout, master_clock_accuracy) = \
+        LE_CONN_COMPLETE.unpack_from(view, offset)
     result["status"] = status
     result["handle"] = handle
     result["role"] = role
     result["peer_bluetooth_address_type"] = peer_bdaddr_type
-    result["peer_device_address"] = device_address
+    result["peer_device_address"] = _bdaddr(view, offset + 5).lower()
     result["interval"] = interval
     result["latency"] = latency
     result["supervision_timeout"] = supervision_timeout
     result["master_clock_accuracy"] = master_clock_accuracy
-    return result
-
 
-def _handle_le_read_remote_used_features(pkt):
-    result = {}
-    result["features"] = []
-    status, handle = struct.unpack("<BH", pkt[:3])
-    result["status"] = status
-    result["handle"] = status
-    for i in range(8):
-        result["features"].append(struct.unpack("<B", pkt[3 + i])[0])
-    return result
-
-
-def _handle_le_advertising_report(pkt):
-    result = {}
-    num_reports = struct.unpack("<B", pkt[0])[0]
-    report_pkt_offset = 0
-    result["number_of_advertising_reports"] = num_reports
-    result["advertising_reports"] = []
-    for i in xrange(0, num_reports):
-        report = {}
-
-        report_event_type = struct.unpack("<B", pkt[report_pkt_offset + 1])[0]
-        report["report_type_id"] = report_event_type
-
-        bdaddr_type = struct.unpack("<B", pkt[report_pkt_offset + 2])[0]
-        report["peer_bluetooth_address_type"] = bdaddr_type
-
-        device_addr = util.packed_bdaddr_to_string(
-            pkt[report_pkt_offset + 3:report_pkt_offset + 9])
-        report["peer_bluetooth_address"] = device_addr.upper()
-        report["peer_bluetooth_address_s"] = util.short_bt_address(report["peer_bluetooth_address"])
-
-        report_data_length, = struct.unpack("<B", pkt[report_pkt_offset + 9])
-        report["report_metadata_length"] = report_data_length
-
-        if report_event_type == LE_ADV_IND:
-            report["report_type_string"] = "LE_ADV_IND"
-
-        elif report_event_type == LE_ADV_DIRECT_IND:
-            report["report_type_string"] = "LE_ADV_DIRECT_IND"
-
-        elif report_event_type == LE_ADV_SCAN_IND:
-            report["report_type_string"] = "LE_ADV_SCAN_IND"
 
-        elif report_event_type == LE_ADV_NONCONN_IND:
-            report["report_type_string"] = "LE_ADV_NONCONN_IND"
+def _handle_le_conn_update_complete(view, offset, result, lazy_hex):
+    (result["status"], result["handle"], result["interval"],
+     result["latency"], result["supervision_timeout"]) = \
+        LE_CONN_UPDATE_COMPLETE.unpack_from(view, offset)
 
-        elif report_event_type == LE_ADV_SCAN_RSP:
-            report["report_type_string"] = "LE_ADV_SCAN_RSP"
 
-        else:
-            report["report_type_string"] = "UNKNOWN"
-
-        if report_data_length > 0:
-            report["payload_binary"] = \
-                (pkt[report_pkt_offset +
-                 10:report_pkt_offset +
-                 10 + report_data_length + 1])
-            report["payload"] = util.packet_as_hex_string(
-                report["payload_binary"], flag_with_spacing=True,
-                flag_force_capitalize=True)
-
-        # Each report length is (2 (event type, bdaddr type) + 6 (the address)
-        #    + 1 (data length field) + data length + 1 (rssi)) bytes long.
-        report_pkt_offset = report_pkt_offset + 10 + report_data_length + 1
-        rssi, = struct.unpack("<b", pkt[report_pkt_offset - 1])
-        report["rssi"] = rssi
-        result["advertising_reports"].append(report)
+def _handle_le_read_remote_used_features(view, offset, result, lazy_hex):
+    features = LE_REMOTE_USED_FEATURES.unpack_from(view, offset)
+    result["status"] = features[0]
+    result["handle"] = features[1]
+    result["features"] = list(features[2:])
 
-    return result
 
-def _handle_le_advertising_report_3(pkt):
-    result = {}
+def _handle_le_ltk_request(view, offset, result, lazy_hex):
+    result["handle"], random_number, result["encrypted_diversifier"] = \
+        LE_LTK_REQUEST.unpack_from(view, offset)
+    result["random_number"] = random_number
 
-    num_reports = pkt[0]
 
-    report_pkt_offset = 0
+def _handle_le_advertising_report(view, offset, result, lazy_hex):
+    num_reports, = UINT8.unpack_from(view, offset)
+    offset += UINT8.size
     result["number_of_advertising_reports"] = num_reports
-    result["advertising_reports"] = []
+    reports = result["advertising_reports"] = []
 
     # Each report length is (2 (event type, bdaddr type) + 6 (the address)
     #    + 1 (data length field) + data length + 1 (rssi)) bytes long.
-    for i in range(0, num_reports):
-        report = {}
-
-        report_event_type, bdaddr_type = struct.unpack("<BB", bytes(pkt[report_pkt_offset+1:report_pkt_offset+3]))
-
-        report_data_length = pkt[report_pkt_offset + 9]
-        rssi = util.c2b(pkt[report_pkt_offset + 10 + report_data_length])
+    for i in range(num_reports):
+        report = util.LazyHexDict() if lazy_hex else {}
+        report_event_type, bdaddr_type = ADV_REPORT_TYPES.unpack_from(
+            view, offset)
+        report_data_length, = UINT8.unpack_from(view, offset + 8)
+        device_addr = _bdaddr(view, offset + 2)
+        data = offset + ADV_REPORT_FIXED
+        rssi, = RSSI.unpack_from(view, data + report_data_length)
 
         report["rssi"] = rssi
         report["report_type_id"] = report_event_type
         report["peer_bluetooth_address_type"] = bdaddr_type
         report["report_metadata_length"] = report_data_length
-
-        device_addr = util.packed_bdaddr_to_string(pkt[report_pkt_offset + 3:report_pkt_offset + 9])
-        report["peer_bluetooth_address"] = device_addr.upper()
-        report["peer_bluetooth_address_s"] = util.short_bt_address(report["peer_bluetooth_address"])
-
-        if report_event_type == LE_ADV_IND:
-            report["report_type_string"] = "LE_ADV_IND"
-        elif report_event_type == LE_ADV_DIRECT_IND:
-            report["report_type_string"] = "LE_ADV_DIRECT_IND"
-        elif report_event_type == LE_ADV_SCAN_IND:
-            report["report_type_string"] = "LE_ADV_SCAN_IND"
-        elif report_event_type == LE_ADV_NONCONN_IND:
-            report["report_type_string"] = "LE_ADV_NONCONN_IND"
-        elif report_event_type == LE_ADV_SCAN_RSP:
-            report["report_type_string"] = "LE_ADV_SCAN_RSP"
-        else:
-            report["report_type_string"] = "UNKNOWN"
+        report["peer_bluetooth_address"] = device_addr
+        report["peer_bluetooth_address_s"] = device_addr.replace(':', '')
+        report["report_type_string"] = REPORT_TYPE_STRINGS.get(
+            report_event_type, "UNKNOWN")
         if report_data_length > 0:
-            report["payload_binary"] = (pkt[report_pkt_offset + 10:report_pkt_offset + 10 + report_data_length + 1])
-            report["payload"] = util.packet_as_hex_string(report["payload_binary"], flag_with_spacing=True, flag_force_capitalize=True)
-
-        report_pkt_offset = report_pkt_offset + 10 + report_data_length + 1
-        result["advertising_reports"].append(report)
-
-    return result
-
-if sys.version > '3':
-    _handle_le_advertising_report = _handle_le_advertising_report_3
+            # data followed by the rssi byte
+            payload = report["payload_binary"] = \
+                view[data:data + report_data_length + RSSI.size].tobytes()
+            if lazy_hex:
+                report.defer_hex("payload", payload, flag_with_spacing=True,
+                                 flag_force_capitalize=True)
+            else:
+                report["payload"] = util.packet_as_hex_string(
+                    payload, flag_with_spacing=True,
+                    flag_force_capitalize=True)
+
+        offset = data + report_data_length + RSSI.size
+        reports.append(report)
+
+
+_UNKNOWN = ("UNKNOWN", None)
+
+# event code -> (name, handler(view, offset, result, lazy_hex))
+EVENT_HANDLERS = {
+    EVT_LE_META_EVENT: ("EVT_LE_META_EVENT", _handle_le_meta_event),
+    EVT_NUM_COMP_PKTS: ("EVT_NUM_COMP_PKTS", _handle_num_completed_packets),
+    EVT_INQUIRY_RESULT_WITH_RSSI: ("EVT_INQUIRY_RESULT_WITH_RSSI",
+                                   _handle_inquiry_result_with_rssi),
+    EVT_INQUIRY_RESULT: ("EVT_INQUIRY_RESULT", _handle_inquiry_result),
+    EVT_DISCONN_COMPLETE: ("EVT_DISCONN_COMPLETE", _handle_disconn_complete),
+    EVT_CMD_STATUS: ("EVT_CMD_STATUS", _handle_command_status),
+    EVT_CMD_COMPLETE: ("EVT_CMD_COMPLETE", _handle_command_complete),
+    EVT_INQUIRY_COMPLETE: ("EVT_INQUIRY_COMPLETE", _handle_inquiry_complete),
+}
+
+# LE meta subevent code -> (name, handler)
+LE_SUBEVENT_HANDLERS = {
+    EVT_LE_ADVERTISING_REPORT: ("EVT_LE_ADVERTISING_REPORT",
+                                _handle_le_advertising_report),
+    EVT_LE_CONN_COMPLETE: ("EVT_LE_CONN_COMPLETE",
+                           _handle_le_connection_complete),
+    EVT_LE_CONN_UPDATE_COMPLETE: ("EVT_LE_CONN_UPDATE_COMPLETE",
+                                  _handle_le_conn_update_complete),
+    EVT_LE_READ_REMOTE_USED_FEATURES_COMPLETE: (
+        "EVT_LE_READ_REMOTE_USED_FEATURES_COMPLETE",
+        _handle_le_read_remote_used_features),
+    EVT_LE_LTK_REQUEST: ("EVT_LE_LTK_REQUEST", _handle_le_ltk_request),
+}
+
+REPORT_TYPE_STRINGS = {
+    LE_ADV_IND: "LE_ADV_IND",
+    LE_ADV_DIRECT_IND: "LE_ADV_DIRECT_IND",
+    LE_ADV_SCAN_IND: "LE_ADV_SCAN_IND",
+    LE_ADV_NONCONN_IND: "LE_ADV_NONCONN_IND",
+    LE_ADV_SCAN_RSP: "LE_ADV_SCAN_RSP",
+}
 
 
 if __name__ == '__main__':
@@ -580,19 +822,7 @@ if __name__ == '__main__':
     sock = deviceOpen(BT_DEV_ID)
     hci_le_set_scan_parameters(sock)
     hci_le_enable_scan(sock)
-
-
-    # preserve old filter setting
-    old_filter = sock.getsockopt(bluez.SOL_HCI,
-                                 bluez.HCI_FILTER, 14)
-    # perform a device inquiry on bluetooth device #0
-    # The inquiry should last 8 * 1.28 = 10.24 seconds
-    # before the inquiry is performed, bluez should flush its cache of
-    # previously discovered devices
-    flt = bluez.hci_filter_new()
-    bluez.hci_filter_all_events(flt)
-    bluez.hci_filter_set_ptype(flt, bluez.HCI_EVENT_PKT)
-    sock.setsockopt(bluez.SOL_HCI, bluez.HCI_FILTER, flt)
+    sock.setsockopt(SOL_HCI, HCI_FILTER, hci_event_filter())
 
     while True:
         pkt = sock.recv(255)
@@ -0,0 +1,239 @@
+"""
+btsnoop capture recorder and replayer
+
+Captures are standard btsnoop files (datalink 1002, HCI UART/H4), so they
+also open in Wireshark. Replay feeds the frames through the usual
+BLE.decode -> filter -> on_message path without Bluetooth hardware:
+
+    sensor.transport = btsnoop.ReplayTransport('capture.btsnoop')
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import errno
+import os
+import socket
+import struct
+import threading
+import time
+
+
+BTSNOOP_MAGIC = b'btsnoop\0'
+BTSNOOP_VERSION = 1
+BTSNOOP_DATALINK_H4 = 1002
+# flags: bit 0 received, bit 1 command / event
+BTSNOOP_FLAGS_EVENT_RECEIVED = 0x03
+# microseconds between 0000-01-01 and 1970-01-01
+BTSNOOP_EPOCH_DELTA = 0x00dcddb30f2f8000
+
+FILE_HEADER = struct.Struct(">8sII")
+RECORD_HEADER = struct.Struct(">IIIIq")
+
+
+class BtsnoopWriter(object):
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(FILE_HEADER.pack(
+            BTSNOOP_MAGIC, BTSNOOP_VERSION, BTSNOOP_DATALINK_H4))
+        self.drops = 0
+
+    def write(self, frame, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        frame = bytes(frame)
+        self.file.write(RECORD_HEADER.pack(
+            len(frame), len(frame), BTSNOOP_FLAGS_EVENT_RECEIVED, self.drops,
+            int(timestamp * 1000000) + BTSNOOP_EPOCH_DELTA))
+        self.file.write(frame)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_btsnoop(path):
+    """
+    Yield (timestamp, frame) for every record of a btsnoop file,
+    timestamp in seconds since the unix epoch.
+    """
+    with open(path, 'rb') as f:
+        magic, version, datalink = FILE_HEADER.unpack(
+            f.read(FILE_HEADER.size))
+        if magic != BTSNOOP_MAGIC:
+            raise ValueError('%s is not a btsnoop file' % path)
+        if datalink != BTSNOOP_DATALINK_H4:
+            logger.warning('unexpected btsnoop datalink %s', datalink)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            _, included, _, _, timestamp = RECORD_HEADER.unpack(header)
+            frame = f.read(included)
+            if len(frame) < included:
+                return
+            yield (timestamp - BTSNOOP_EPOCH_DELTA) / 1000000.0, frame
+
+
+class RecordingSocket(object):
+    # socket proxy writing every received frame to a BtsnoopWriter
+
+    def __init__(self, sock, writer, release=None):
+        self.sock = sock
+        self.writer = writer
+        # called instead of writer.close() when the writer is shared
+        self.release = release or writer.close
+        # only offer recv_into when the wrapped socket has it, so that
+        # BLE._recv_batch can fall back to recv otherwise
+        if hasattr(sock, 'recv_into'):
+            self.recv_into = self._recv_into
+
+    def recv(self, bufsize, flags=0):
+        frame = self.sock.recv(bufsize, flags)
+        self.writer.write(frame)
+        return frame
+
+    def _recv_into(self, buf, nbytes=0, flags=0):
+        n = self.sock.recv_into(buf, nbytes, flags)
+        self.writer.write(buf[:n])
+        return n
+
+    def close(self):
+        self.sock.close()
+        self.release()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class ReplaySocket(object):
+    """
+    Socket look-alike returning the frames of a btsnoop file.
+
+    With realtime the original pacing is kept (scaled by speed), otherwise
+    frames come as fast as they are read. EOFError is raised at the end of
+    the capture, which ends BLE.loop.
+
+    fileno() is a pipe that is readable while a frame is due (or the
+    capture has ended), so the socket also works with select and asyncio
+    reader callbacks.
+    """
+
+    def __init__(self, path, realtime=False, speed=1.0):
+        self.records = read_btsnoop(path)
+        self.realtime = realtime
+        self.speed = speed
+        self.start = None
+        self.pending = None
+        self.blocking = True
+        self.pipe = None
+        self.armed = False
+        self.timer = None
+
+    def fileno(self):
+        if self.pipe is None:
+            self.pipe = os.pipe()
+            self._arm()
+        return self.pipe[0]
+
+    def _arm(self):
+        if self.pipe is not None and not self.armed:
+            self.armed = True
+            os.write(self.pipe[1], b'\0')
+
+    def _wait(self, delay):
+        # not readable until the next frame is due
+        if self.pipe is not None and self.armed:
+            os.read(self.pipe[0], 1)
+            self.armed = False
+        if self.timer is None or not self.timer.is_alive():
+            self.timer = threading.Timer(delay, self._arm)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _next(self, flags):
+        if self.pending is None:
+            self.pending = next(self.records, None)
+            if self.pending is None:
+                raise EOFError('end of capture')
+        timestamp, frame = self.pending
+        if self.realtime:
+            now = time.time()
+            if self.start is None:
+                self.start = (now, timestamp)
+            due = self.start[0] + (timestamp - self.start[1]) / self.speed
+            if due > now:
+                if flags & socket.MSG_DONTWAIT or not self.blocking:
+                    self._wait(due - now)
+                    raise IOError(errno.EAGAIN, 'no frame due yet')
+                time.sleep(due - now)
+        self.pending = None
+        return frame
+
+    def recv(self, bufsize, flags=0):
+        return self._next(flags)[:bufsize]
+
+    def recv_into(self, buf, nbytes=0, flags=0):
+        frame = self._next(flags)[:nbytes or len(buf)]
+        buf[:len(frame)] = frame
+        return len(frame)
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def close(self):
+        self.records.close()
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.pipe is not None:
+            for fd in self.pipe:
+                os.close(fd)
+            self.pipe = None
+
+
+class ReplayTransport(object):
+
+    def __init__(self, path, realtime=False, speed=1.0):
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+
+    def open(self, ble):
+        return ReplaySocket(self.path, self.realtime, self.speed)
+
+
+class RecordingTransport(object):
+    # records whatever `transport` (the live bluez socket by default) receives;
+    # sockets opened on several adapters share one capture file, which is
+    # closed with the last of them
+
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = transport
+        self.writer = None
+        self.users = 0
+
+    def open(self, ble):
+        if self.transport is None:
+            from .ble import BluezTransport
+            self.transport = BluezTransport()
+        sock = self.transport.open(ble)
+        if self.writer is None:
+            self.writer = BtsnoopWriter(self.path)
+        self.users += 1
+        return RecordingSocket(sock, self.writer, self._release)
+
+    def _release(self):
+        self.users -= 1
+        if self.users <= 0:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.users = 0
@@ -0,0 +1,102 @@
+"""
+deadband / change-based reporting
+
+DeadbandFilter passes a beacon downstream only when some field moved past
+its deadband since the last reading reported for that sensor, or when the
+heartbeat interval has passed:
+
+    sensor.on_message = DeadbandFilter(sink, heartbeat=600)
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import collections
+
+from .util import to_epoch
+
+
+# field -> (absolute, relative) deadband; None disables that check
+DEFAULT_THRESHOLDS = {
+    'val_temp': (0.2, None),
+    'val_humi': (1.0, None),
+    'val_light': (5, 0.1),
+    'val_uv': (0.1, None),
+    'val_pressure': (0.5, None),
+    'val_noise': (3.0, None),
+    'val_di': (0.5, None),
+    'val_heat': (0.5, None),
+    'val_battery': (50.0, None),
+}
+
+
+class DeadbandFilter(object):
+    """
+    thresholds maps a sensor type ('IM', 'EP') or '*' (any type) to a
+    {field: (absolute, relative)} dict; a type's dict is layered over '*'.
+    A field triggers when |new - last| > absolute or
+    |new - last| > relative * |last|.
+    """
+
+    def __init__(self, on_message=None, thresholds=None, heartbeat=600):
+        if thresholds is None:
+            thresholds = {'*': DEFAULT_THRESHOLDS}
+        self.thresholds = thresholds
+        self.on_message = on_message
+        self.heartbeat = heartbeat
+        self._per_type = {}
+        self.last = {}
+        self.emitted = 0
+        self.suppressed = 0
+        self.heartbeats = 0
+        self.triggers = collections.Counter()
+
+    def _thresholds(self, sensor_type):
+        # merged '*' and per type thresholds as a list of tuples
+        merged = self._per_type.get(sensor_type)
+        if merged is None:
+            fields = dict(self.thresholds.get('*', {}))
+            fields.update(self.thresholds.get(sensor_type, {}))
+            merged = self._per_type[sensor_type] = sorted(fields.items())
+        return merged
+
+    def check(self, sensor_beacon):
+        # True when the beacon should be reported, and remember it if so
+        last = self.last.get(sensor_beacon.bt_address)
+        report = last is None
+        if not report:
+            if self.heartbeat is not None and \
+                    to_epoch(sensor_beacon.tick_last_update) - \
+                    to_epoch(last.tick_last_update) >= self.heartbeat:
+                self.heartbeats += 1
+                report = True
+            else:
+                for field, (absolute, relative) in \
+                        self._thresholds(sensor_beacon.sensor_type):
+                    old = getattr(last, field)
+                    delta = abs(getattr(sensor_beacon, field) - old)
+                    if (absolute is not None and delta > absolute) or \
+                            (relative is not None and
+                             delta > relative * abs(old)):
+                        self.triggers[field] += 1
+                        report = True
+                        break
+        if report:
+            self.last[sensor_beacon.bt_address] = sensor_beacon
+            self.emitted += 1
+        else:
+            self.suppressed += 1
+        return report
+
+    def __call__(self, sensor_beacon):
+        if self.check(sensor_beacon) and self.on_message is not None:
+            self.on_message(sensor_beacon)
+
+    def stats(self):
+        return {
+            'emitted': self.emitted,
+            'suppressed': self.suppressed,
+            'heartbeats': self.heartbeats,
+            'triggers': dict(self.triggers),
+        }
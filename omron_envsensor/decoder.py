@@ -0,0 +1,216 @@
+"""
+fast path decoder from a raw HCI frame straight to SensorBeacon
+
+Reads the fixed 2JCIE-BL01 layout out of a memoryview of the received frame
+with precompiled structs, skipping hci_le_parse_response_packet and its
+intermediate dicts.
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import binascii
+import struct
+import sys
+
+from .ble import EVT_LE_META_EVENT, EVT_LE_ADVERTISING_REPORT, \
+    ADV_TYPE_MANUFACTURER_SPECIFIC_DATA, ADV_TYPE_SHORT_LOCAL_NAME
+from .sensorbeacon import SensorBeacon, COMPANY_ID, REJECT_LENGTH, \
+    REJECT_AD_TYPE, REJECT_COMPANY_ID, REJECT_NAME
+
+
+# Omron advertising data length
+BEACON_DATA_LENGTH = 31
+
+# packet type, event code, parameter length, LE subevent, number of reports
+HCI_LE_META_HEADER = struct.Struct("<BBBBB")
+# event type, address type, address, data length
+ADV_REPORT_HEADER = struct.Struct("<BB6sB")
+# AD type, company ID, seq, temp, humi, light, uv, pressure, noise,
+# accel x / di, accel y / heat, accel z, battery
+BEACON_MEASUREMENT = struct.Struct("<BHBhHHHHHhhhB")
+# AD type of the shortened local name, name
+BEACON_NAME = struct.Struct("<B2s")
+RSSI = struct.Struct("<b")
+
+# offsets inside the advertising data
+_MEASUREMENT_OFFSET = 4
+_NAME_OFFSET = 28
+
+_SENSOR_TYPES = {b"IM": "IM", b"EP": "EP"}
+
+# byte offsets inside a raw frame, relative to the start of a report
+_REPORT_LENGTH = 8
+_REPORT_AD_TYPE = ADV_REPORT_HEADER.size + _MEASUREMENT_OFFSET
+_REPORT_COMPANY_LO = _REPORT_AD_TYPE + 1
+_REPORT_COMPANY_HI = _REPORT_AD_TYPE + 2
+_REPORT_NAME_TYPE = ADV_REPORT_HEADER.size + _NAME_OFFSET
+_REPORT_NAME = _REPORT_NAME_TYPE + 1
+_COMPANY_LO = COMPANY_ID & 0xFF
+_COMPANY_HI = COMPANY_ID >> 8
+_NAMES = (b"IM", b"EP")
+
+
+def _short_address(addr):
+    # same as util.short_bt_address(util.packed_bdaddr_to_string(addr).upper())
+    return binascii.hexlify(addr[::-1]).decode("ascii").upper()
+
+
+def is_omron_frame(pkt):
+    """
+    Cheap check on a raw HCI frame, done before any parsing.
+
+    True if at least one advertising report in the frame looks like an
+    Omron beacon (the same checks as verify_beacon_packet, by byte offset).
+    """
+    if sys.version < '3':
+        pkt = bytearray(pkt)
+    size = len(pkt)
+    if size < HCI_LE_META_HEADER.size or pkt[1] != EVT_LE_META_EVENT or \
+            pkt[3] != EVT_LE_ADVERTISING_REPORT:
+        return False
+
+    offset = HCI_LE_META_HEADER.size
+    for i in range(pkt[4]):
+        if offset + ADV_REPORT_HEADER.size > size:
+            return False
+        length = pkt[offset + _REPORT_LENGTH]
+        if length == BEACON_DATA_LENGTH and \
+                offset + ADV_REPORT_HEADER.size + length < size and \
+                pkt[offset + _REPORT_AD_TYPE] == \
+                ADV_TYPE_MANUFACTURER_SPECIFIC_DATA and \
+                pkt[offset + _REPORT_COMPANY_LO] == _COMPANY_LO and \
+                pkt[offset + _REPORT_COMPANY_HI] == _COMPANY_HI and \
+                pkt[offset + _REPORT_NAME_TYPE] == ADV_TYPE_SHORT_LOCAL_NAME \
+                and bytes(pkt[offset + _REPORT_NAME:
+                              offset + _REPORT_NAME + 2]) in _NAMES:
+            return True
+        offset += ADV_REPORT_HEADER.size + length + RSSI.size
+
+    return False
+
+
+def frame_reject_reasons(pkt):
+    """
+    Why each advertising report of a raw frame is not an Omron beacon,
+    one sensorbeacon.REJECT_* per report (None for accepted reports).
+    Only meant for diagnostics; is_omron_frame is the fast check.
+    """
+    pkt = bytearray(pkt)
+    num_reports = advertising_report_count(pkt)
+    if num_reports is None:
+        return []
+    reasons = []
+    offset = HCI_LE_META_HEADER.size
+    for i in range(num_reports):
+        if offset + ADV_REPORT_HEADER.size > len(pkt):
+            reasons.append(REJECT_LENGTH)
+            break
+        length = pkt[offset + _REPORT_LENGTH]
+        if length != BEACON_DATA_LENGTH or \
+                offset + ADV_REPORT_HEADER.size + length >= len(pkt):
+            reasons.append(REJECT_LENGTH)
+        elif pkt[offset + _REPORT_AD_TYPE] != \
+                ADV_TYPE_MANUFACTURER_SPECIFIC_DATA:
+            reasons.append(REJECT_AD_TYPE)
+        elif pkt[offset + _REPORT_COMPANY_LO] != _COMPANY_LO or \
+                pkt[offset + _REPORT_COMPANY_HI] != _COMPANY_HI:
+            reasons.append(REJECT_COMPANY_ID)
+        elif pkt[offset + _REPORT_NAME_TYPE] != ADV_TYPE_SHORT_LOCAL_NAME or \
+                bytes(pkt[offset + _REPORT_NAME:
+                          offset + _REPORT_NAME + 2]) not in _NAMES:
+            reasons.append(REJECT_NAME)
+        else:
+            reasons.append(None)
+        offset += ADV_REPORT_HEADER.size + length + RSSI.size
+    return reasons
+
+
+def advertising_report_count(pkt):
+    # number of reports in an LE advertising event, None for other frames
+    if len(pkt) < HCI_LE_META_HEADER.size:
+        return None
+    _, event, _, subevent, num_reports = HCI_LE_META_HEADER.unpack_from(pkt)
+    if event != EVT_LE_META_EVENT or subevent != EVT_LE_ADVERTISING_REPORT:
+        return None
+    return num_reports
+
+
+def split_reports(pkt):
+    """
+    Split a raw LE advertising frame into single-report frames, returned
+    as (address, frame) pairs; empty for other frames.
+    """
+    num_reports = advertising_report_count(pkt)
+    if num_reports is None:
+        return []
+    view = memoryview(pkt)
+    frames = []
+    offset = HCI_LE_META_HEADER.size
+    for i in range(num_reports):
+        if offset + ADV_REPORT_HEADER.size > len(view):
+            break
+        _, _, addr, length = ADV_REPORT_HEADER.unpack_from(view, offset)
+        end = offset + ADV_REPORT_HEADER.size + length + RSSI.size
+        if end > len(view):
+            break
+        report = view[offset:end]
+        if num_reports == 1:
+            frames.append((addr, bytes(view[:end])))
+        else:
+            frames.append((addr, HCI_LE_META_HEADER.pack(
+                view[0], EVT_LE_META_EVENT, len(report) + 2,
+                EVT_LE_ADVERTISING_REPORT, 1) + report.tobytes()))
+        offset = end
+    return frames
+
+
+def iter_frame(pkt, gateway, beacon_class=SensorBeacon):
+    """
+    Decode every Omron beacon in a raw HCI LE advertising frame.
+
+    Yields beacons identical to the ones built by OmronEnvSensor.filter_all.
+    """
+    view = memoryview(pkt)
+    num_reports = advertising_report_count(view)
+    if num_reports is None:
+        return
+
+    offset = HCI_LE_META_HEADER.size
+    for i in range(num_reports):
+        if offset + ADV_REPORT_HEADER.size > len(view):
+            return
+        _, _, addr, length = ADV_REPORT_HEADER.unpack_from(view, offset)
+        data = offset + ADV_REPORT_HEADER.size
+        offset = data + length + RSSI.size
+
+        if length != BEACON_DATA_LENGTH or offset > len(view):
+            continue
+        ad_type, company_id, seq_num, temp, humi, light, uv, pressure, \
+            noise, x, y, z, battery = BEACON_MEASUREMENT.unpack_from(
+                view, data + _MEASUREMENT_OFFSET)
+        if ad_type != ADV_TYPE_MANUFACTURER_SPECIFIC_DATA or \
+                company_id != COMPANY_ID:
+            continue
+        name_type, name = BEACON_NAME.unpack_from(view, data + _NAME_OFFSET)
+        sensor_type = _SENSOR_TYPES.get(name)
+        if name_type != ADV_TYPE_SHORT_LOCAL_NAME or sensor_type is None:
+            continue
+
+        rssi, = RSSI.unpack_from(view, offset - RSSI.size)
+        yield beacon_class.from_raw(
+            _short_address(addr), sensor_type, gateway, seq_num,
+            temp, humi, light, uv, pressure, noise, x, y, z, battery, rssi)
+
+
+def decode_frame(pkt, gateway, beacon_class=SensorBeacon):
+    """
+    Decode the first Omron beacon found in a raw HCI LE advertising frame.
+
+    Returns a SensorBeacon identical to the one built by
+    OmronEnvSensor.filter, or None if the frame carries no Omron beacon.
+    """
+    for sensor_beacon in iter_frame(pkt, gateway, beacon_class):
+        return sensor_beacon
+    return None
@@ -0,0 +1,137 @@
+"""
+decoupled callback dispatch
+
+A bounded queue between the socket loop and the on_message callback, served
+by a pool of worker threads, so a slow consumer no longer stalls recv.
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# overflow policies
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+_STOP = object()
+
+
+class Dispatcher(object):
+    """
+    Hand messages to callback on worker threads through a bounded queue.
+
+    When the queue is full, `policy` decides: BLOCK waits for room,
+    DROP_OLDEST discards the oldest queued message, DROP_NEWEST discards
+    the incoming one. Set it as BLE.dispatcher to use it for on_message
+    (on_message may then stay None). After stop() every message is dropped.
+    """
+
+    def __init__(self, callback, maxsize=1024, workers=1, policy=BLOCK):
+        if policy not in (BLOCK, DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('unknown overflow policy %r' % (policy,))
+        self.callback = callback
+        self.policy = policy
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        # serializes DROP_OLDEST eviction with stop(), so that the stop
+        # markers are never evicted
+        self.put_lock = threading.Lock()
+        self.stopped = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.errors = 0
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work,
+                                 name='omron-dispatch-%d' % i)
+            t.daemon = True
+            self.threads.append(t)
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def stop(self, timeout=None):
+        # deliver what is queued, then stop the workers; later messages are
+        # dropped
+        with self.put_lock:
+            self.stopped = True
+        for t in self.threads:
+            self.queue.put(_STOP)
+        for t in self.threads:
+            t.join(timeout)
+
+    def put(self, message):
+        if self.stopped:
+            self._drop()
+            return False
+        if self.policy == BLOCK:
+            self.queue.put(message)
+        elif self.policy == DROP_NEWEST:
+            try:
+                self.queue.put_nowait(message)
+            except queue.Full:
+                self._drop()
+                return False
+        else:
+            with self.put_lock:
+                if self.stopped:
+                    self._drop()
+                    return False
+                while True:
+                    try:
+                        self.queue.put_nowait(message)
+                        break
+                    except queue.Full:
+                        try:
+                            self.queue.get_nowait()
+                            self.queue.task_done()
+                            self._drop()
+                        except queue.Empty:
+                            pass
+        with self.lock:
+            self.enqueued += 1
+        return True
+
+    __call__ = put
+
+    def _drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def _work(self):
+        while True:
+            message = self.queue.get()
+            try:
+                if message is _STOP:
+                    return
+                self.callback(message)
+                with self.lock:
+                    self.delivered += 1
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+                logger.exception('on_message failed')
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'delivered': self.delivered,
+                'errors': self.errors,
+                'depth': self.queue.qsize(),
+            }
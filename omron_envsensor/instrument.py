@@ -0,0 +1,123 @@
+"""
+hot path instrumentation
+
+Set BLE.instrumentation = PipelineStats() to count frames by HCI event,
+verification rejections by reason, and recv / parse / decode / callback
+latencies. BLE.stats() returns a snapshot. With instrumentation left at
+None the receive loop runs without any of this.
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import collections
+import time
+
+from . import decoder
+from .ble import EVT_LE_META_EVENT
+
+STAGES = ('recv', 'parse', 'decode', 'callback')
+
+
+class Histogram(object):
+    # latency histogram with power-of-two microsecond buckets
+
+    def __init__(self, buckets=24):
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1000000).bit_length()
+        if bucket >= len(self.counts):
+            bucket = len(self.counts) - 1
+        self.counts[bucket] += 1
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile, in us
+        if not self.count:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return 1 << bucket
+        return 1 << (len(self.counts) - 1)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count * 1000000 if self.count else 0.0,
+            'max_us': self.max * 1000000,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+        }
+
+
+class PipelineStats(object):
+
+    def __init__(self, log_interval=None):
+        self.log_interval = log_interval
+        self.reset()
+
+    def reset(self):
+        self.frames = collections.Counter()
+        self.rejects = collections.Counter()
+        self.messages = 0
+        self.latency = dict((stage, Histogram()) for stage in STAGES)
+        self.started = self.last_log = time.time()
+
+    def frame(self, pkt):
+        # count by (event, LE subevent) read straight from the raw frame
+        pkt = bytearray(pkt[:4])
+        if len(pkt) < 2:
+            key = 'short'
+        elif pkt[1] == EVT_LE_META_EVENT and len(pkt) > 3:
+            key = '0x%02X/0x%02X' % (pkt[1], pkt[3])
+        else:
+            key = '0x%02X' % pkt[1]
+        self.frames[key] += 1
+
+    def reject(self, reason):
+        self.rejects[reason] += 1
+
+    def reject_frame(self, pkt):
+        for reason in decoder.frame_reject_reasons(pkt):
+            if reason is not None:
+                self.rejects[reason] += 1
+
+    def time(self, stage, seconds):
+        self.latency[stage].add(seconds)
+
+    def tick(self):
+        if self.log_interval is None:
+            return
+        now = time.time()
+        if now - self.last_log >= self.log_interval:
+            self.last_log = now
+            logger.info('%s', self.format_line())
+
+    def format_line(self):
+        return 'frames=%d messages=%d rejects=%s %s' % (
+            sum(self.frames.values()), self.messages,
+            dict(self.rejects), ' '.join(
+                '%s_p99=%dus' % (stage, self.latency[stage].percentile(99))
+                for stage in STAGES))
+
+    def snapshot(self):
+        return {
+            'uptime': time.time() - self.started,
+            'frames': dict(self.frames),
+            'rejects': dict(self.rejects),
+            'messages': self.messages,
+            'latency': dict((stage, h.snapshot())
+                            for stage, h in self.latency.items()),
+        }
@@ -0,0 +1,138 @@
+"""
+concurrent scanning on several HCI adapters
+
+MultiOmronEnvSensor opens one socket per adapter and multiplexes them with
+select() in a single loop. Copies of the same reading (bt_address, seq_num)
+heard by several adapters, or rebroadcast, are merged: after merge_window
+seconds the copy with the best RSSI is delivered once, with
+beacon.adapter set to the device id that heard it.
+
+Frames are read one at a time; batch_size and instrumentation are not
+supported. The loop ends once every adapter's replayed capture has ended.
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import errno
+import select
+import time
+
+from .ble import BLE
+from .omron import OmronEnvSensor
+
+
+class MultiOmronEnvSensor(OmronEnvSensor):
+
+    def __init__(self, name=None, device_ids=(0,), merge_window=0.5):
+        super(MultiOmronEnvSensor, self).__init__(name, device_ids[0])
+        self.device_ids = list(device_ids)
+        self.merge_window = merge_window
+        self.adapters = []
+        # the BLE behind each adapters entry
+        self.scanners = []
+        # (bt_address, seq_num) -> [deadline, best beacon]
+        self.pending = {}
+        # bt_address -> last delivered seq_num
+        self.delivered = {}
+        self.merged = 0
+        self.heard_by = dict((device_id, 0) for device_id in self.device_ids)
+
+    def open(self):
+        if self.batch_size > 1 or self.instrumentation is not None:
+            raise ValueError('MultiOmronEnvSensor supports neither batch_size '
+                             'nor instrumentation')
+        self.adapters = []
+        self.scanners = []
+        for device_id in self.device_ids:
+            adapter = BLE(device_id)
+            adapter.transport = self.transport
+            adapter.rcvbuf = self.rcvbuf
+            adapter.le_meta_only = self.le_meta_only
+            adapter.whitelist = self.whitelist
+            adapter.scan_profile = self.scan_profile
+            adapter.open()
+            # select decides when to read, so a replay that isn't due yet
+            # raises EAGAIN instead of holding up the other adapters
+            adapter.sock.setblocking(False)
+            self.scanners.append(adapter)
+            self.adapters.append((device_id, adapter.sock))
+        self.sock = self.adapters[0][1]
+
+    def close(self):
+        for adapter in self.scanners:
+            adapter.close()
+        self.scanners = []
+        self.adapters = []
+        self.sock = None
+
+    def merge(self, device_id, sensor_beacon, now=None):
+        if now is None:
+            now = time.time()
+        sensor_beacon.adapter = device_id
+        self.heard_by[device_id] += 1
+        key = (sensor_beacon.bt_address, sensor_beacon.seq_num)
+        if self.delivered.get(key[0]) == key[1]:
+            self.merged += 1
+            return
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [now + self.merge_window, sensor_beacon]
+            return
+        self.merged += 1
+        if sensor_beacon.rssi > entry[1].rssi:
+            entry[1] = sensor_beacon
+
+    def due(self, now=None):
+        # pop the merged beacons whose window has passed, oldest first
+        if now is None:
+            now = time.time()
+        ready = sorted((entry for entry in self.pending.values()
+                        if entry[0] <= now), key=lambda entry: entry[0])
+        beacons = []
+        for deadline, sensor_beacon in ready:
+            del self.pending[(sensor_beacon.bt_address, sensor_beacon.seq_num)]
+            self.delivered[sensor_beacon.bt_address] = sensor_beacon.seq_num
+            if self.registry is None or self.registry.update(sensor_beacon):
+                beacons.append(sensor_beacon)
+        return beacons
+
+    def _catchMulti(self):
+        if self.pending:
+            deadline = min(entry[0] for entry in self.pending.values())
+            timeout = max(0.0, deadline - time.time())
+        else:
+            timeout = None
+        readable, _, _ = select.select(
+            [sock for _, sock in self.adapters], [], [], timeout)
+        for device_id, sock in list(self.adapters):
+            if sock not in readable:
+                continue
+            try:
+                pkt = sock.recv(255)
+            except EOFError:
+                # end of this adapter's replayed capture
+                self.adapters.remove((device_id, sock))
+                continue
+            except (OSError, IOError) as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    continue
+                raise
+            for r in self.decode_beacons(pkt):
+                self.merge(device_id, r)
+
+        deliver = self.dispatcher.put if self.dispatcher else self.on_message
+        for r in self.due():
+            deliver(r)
+
+    def loop(self):
+        self.loop = True
+        while self.loop and self.adapters:
+            self._catchMulti()
+        if not self.adapters:
+            # every capture ended; nothing can join the pending merges
+            deliver = self.dispatcher.put if self.dispatcher else \
+                self.on_message
+            for r in self.due(float('inf')):
+                deliver(r)
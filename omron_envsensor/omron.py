@@ -3,12 +3,25 @@ from __future__ import absolute_import
 from logging import getLogger
 logger = getLogger(__name__)
 
+import collections
 import os
 from . import util
 from . import sensorbeacon
+from . import decoder
 from .ble import BLE
 
 class OmronEnvSensor(BLE):
+    # filter() never reads the debug hex strings
+    lazy_hex = True
+    # decode raw frames with decoder.iter_frame instead of filter_all();
+    # ignored when a subclass overrides filter()
+    fast_decode = False
+    # drop frames failing decoder.is_omron_frame before parsing them
+    prefilter = True
+    # record type handed to on_message, e.g. sensorbeacon.CompactSensorBeacon
+    beacon_class = sensorbeacon.SensorBeacon
+    # registry.BeaconRegistry; when set, rebroadcasts of a seq_num are dropped
+    registry = None
 
     def __init__(self, name=None, *args, **kwargs):
         super(OmronEnvSensor, self).__init__(*args, **kwargs)
@@ -18,21 +31,71 @@ class OmronEnvSensor(BLE):
             name = uname[1]
 
         self.name = name
+        # number of reports per LE advertising event -> number of events
+        self.reports_per_event = collections.Counter()
+        # subclasses written against the one-beacon-per-event filter()
+        # keep it in the decode path
+        self._filter_overridden = _function(type(self).filter) is not \
+            _function(OmronEnvSensor.filter)
 
-    def filter(self, result):
+    def decode(self, pkt):
+        beacons = self.decode_beacons(pkt)
+        if self.registry is not None:
+            beacons = [r for r in beacons if self.registry.update(r)]
+        return beacons
+
+    def decode_beacons(self, pkt):
+        # every Omron beacon in the frame, before the registry
+        num_reports = decoder.advertising_report_count(pkt)
+        if num_reports is not None:
+            self.reports_per_event[num_reports] += 1
+        if self.prefilter and not decoder.is_omron_frame(pkt):
+            if self.instrumentation is not None:
+                self.instrumentation.reject_frame(pkt)
+            return []
+        if self.fast_decode and not self._filter_overridden:
+            beacons = list(decoder.iter_frame(pkt, self.name, self.beacon_class))
+        else:
+            beacons = super(OmronEnvSensor, self).decode(pkt)
+        return beacons
 
+    def filter_all(self, result):
+        if self._filter_overridden:
+            r = self.filter(result)
+            if r:
+                return [r]
+            return []
+        return self._beacons(result)
+
+    def _beacons(self, result):
+        beacons = []
         if 'bluetooth_le_subevent_name' in result and result['bluetooth_le_subevent_name'] == 'EVT_LE_ADVERTISING_REPORT':
             for report in result['advertising_reports']:
                 if sensorbeacon.verify_beacon_packet(report):
                     logger.debug(report)
-                    return sensorbeacon.SensorBeacon(
+                    beacons.append(self.beacon_class(
                             report["peer_bluetooth_address_s"],
                             util.classify_beacon_packet(report),
                             self.name,
                             report["payload_binary"]
-                        )
+                        ))
+                elif self.instrumentation is not None:
+                    self.instrumentation.reject(
+                        sensorbeacon.beacon_packet_reject_reason(report))
+        return beacons
+
+    def filter(self, result):
+        # first beacon of the event only, see filter_all
+        beacons = self._beacons(result)
+        if beacons:
+            return beacons[0]
         return None
 
     @staticmethod
     def callback(r):
         r.debug_print()
+
+
+def _function(method):
+    # the plain function behind a Python 2 unbound method
+    return getattr(method, '__func__', method)
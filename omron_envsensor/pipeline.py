@@ -0,0 +1,264 @@
+"""
+multi-process pipeline over shared-memory ring buffers (Python 3.8+)
+
+One receiver process only reads raw frames off the HCI socket, splits
+them into single-report frames and shards them by device address into one
+shared-memory ring per worker. Worker processes decode (and optionally
+serialize) in parallel and send results back; the parent calls the
+sensor's on_message with them. Every device always lands on the same
+worker, so per-device ordering is kept. A full ring drops the new frame
+and counts it.
+
+    sensor = OmronEnvSensor(name, device_id)
+    sensor.on_message = sink
+    Pipeline(sensor, workers=3).run()
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import multiprocessing
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+
+from . import decoder
+from .ble import BLE, HCI_MAX_FRAME_SIZE
+from .omron import OmronEnvSensor
+
+
+# head (frames written), tail (frames read), dropped; 32 bit so that each
+# counter is written atomically on 32 bit CPUs too
+RING_COUNTER = struct.Struct("<I")
+RING_HEADER_SIZE = 3 * RING_COUNTER.size
+SLOT_LENGTH = struct.Struct("<H")
+SLOT_SIZE = SLOT_LENGTH.size + HCI_MAX_FRAME_SIZE
+_HEAD = 0
+_TAIL = RING_COUNTER.size
+_DROPPED = 2 * RING_COUNTER.size
+_MASK = 0xFFFFFFFF
+
+
+class FrameRing(object):
+    """
+    Single producer / single consumer ring of HCI frames in shared memory.
+    The semaphore counts frames ready to read. An empty frame marks the end
+    of the stream. slots must be a power of two so that slot indices stay
+    in step when the 32 bit counters wrap.
+    """
+
+    def __init__(self, slots=4096):
+        if slots < 1 or slots & (slots - 1):
+            raise ValueError('slots must be a power of two')
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=RING_HEADER_SIZE + slots * SLOT_SIZE)
+        self.ready = multiprocessing.Semaphore(0)
+        self.buf = self.shm.buf
+        for offset in (_HEAD, _TAIL, _DROPPED):
+            RING_COUNTER.pack_into(self.buf, offset, 0)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['buf']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buf = self.shm.buf
+
+    def _counter(self, offset):
+        return RING_COUNTER.unpack_from(self.buf, offset)[0]
+
+    def put(self, frame):
+        # producer side; False when the ring is full and frame was dropped
+        head = self._counter(_HEAD)
+        if (head - self._counter(_TAIL)) & _MASK >= self.slots:
+            RING_COUNTER.pack_into(
+                self.buf, _DROPPED, (self._counter(_DROPPED) + 1) & _MASK)
+            return False
+        offset = RING_HEADER_SIZE + (head & (self.slots - 1)) * SLOT_SIZE
+        SLOT_LENGTH.pack_into(self.buf, offset, len(frame))
+        start = offset + SLOT_LENGTH.size
+        self.buf[start:start + len(frame)] = frame
+        RING_COUNTER.pack_into(self.buf, _HEAD, (head + 1) & _MASK)
+        self.ready.release()
+        return True
+
+    def close_stream(self):
+        # the end marker must not be dropped; wait for room
+        while (self._counter(_HEAD) - self._counter(_TAIL)) & _MASK \
+                >= self.slots:
+            time.sleep(0.001)
+        self.put(b'')
+
+    def get(self, timeout=None):
+        # consumer side; None when nothing arrived within timeout
+        if not self.ready.acquire(timeout=timeout):
+            return None
+        tail = self._counter(_TAIL)
+        offset = RING_HEADER_SIZE + (tail & (self.slots - 1)) * SLOT_SIZE
+        length, = SLOT_LENGTH.unpack_from(self.buf, offset)
+        start = offset + SLOT_LENGTH.size
+        frame = bytes(self.buf[start:start + length])
+        RING_COUNTER.pack_into(self.buf, _TAIL, (tail + 1) & _MASK)
+        return frame
+
+    def stats(self):
+        head = self._counter(_HEAD)
+        return {
+            'written': head,
+            'depth': (head - self._counter(_TAIL)) & _MASK,
+            'dropped': self._counter(_DROPPED),
+        }
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _receive(ble, rings, prefilter):
+    # receiver process: socket -> rings, nothing else
+    ble.open()
+    sock = ble.sock
+    workers = len(rings)
+    try:
+        while True:
+            pkt = sock.recv(HCI_MAX_FRAME_SIZE)
+            for address, frame in decoder.split_reports(pkt):
+                if prefilter and not decoder.is_omron_frame(frame):
+                    continue
+                rings[zlib.crc32(address) % workers].put(frame)
+    except EOFError:
+        # end of a replayed capture
+        pass
+    finally:
+        ble.close()
+        for ring in rings:
+            ring.close_stream()
+
+
+def _work(sensor, ring, results, serializer, batch_size):
+    # worker process: ring -> decoded (serialized) results in batches
+    batch = []
+    while True:
+        pkt = ring.get(timeout=0 if batch else None)
+        if pkt is None or len(batch) >= batch_size:
+            results.put(batch)
+            batch = []
+            if pkt is None:
+                continue
+        if not pkt:
+            break
+        for r in sensor.decode(pkt):
+            batch.append(serializer(r) if serializer is not None else r)
+    if batch:
+        results.put(batch)
+    results.put(None)
+    ring.close()
+
+
+class Pipeline(object):
+    """
+    Runs `sensor`'s decoding on worker processes. The worker copies use the
+    sensor's name, fast_decode, beacon_class, lazy_hex and registry; the
+    receiver uses its device_id, transport, rcvbuf and scan settings.
+    serializer (e.g. SensorBeacon.csv_format or
+    serialize.JSONSerializer().line) runs in the workers and must be
+    picklable. slots is the size of each worker's ring, a power of two.
+    """
+
+    def __init__(self, sensor, workers=2, slots=4096, serializer=None,
+                 prefilter=True, batch_size=64):
+        self.sensor = sensor
+        self.workers = workers
+        self.slots = slots
+        self.serializer = serializer
+        self.prefilter = prefilter
+        self.batch_size = batch_size
+        self.rings = []
+        self.processes = []
+        self.receiver = None
+        self.results = None
+        self.delivered = 0
+        self.ring_stats = []
+
+    def _worker_sensor(self):
+        sensor = OmronEnvSensor(self.sensor.name, self.sensor.device_id)
+        sensor.fast_decode = self.sensor.fast_decode
+        sensor.beacon_class = self.sensor.beacon_class
+        sensor.lazy_hex = self.sensor.lazy_hex
+        # the receiver already dropped foreign reports
+        sensor.prefilter = not self.prefilter
+        sensor.registry = self.sensor.registry
+        return sensor
+
+    def start(self):
+        self.rings = [FrameRing(self.slots) for _ in range(self.workers)]
+        self.results = multiprocessing.Queue()
+        for ring in self.rings:
+            p = multiprocessing.Process(
+                target=_work, args=(self._worker_sensor(), ring, self.results,
+                                    self.serializer, self.batch_size))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+
+        ble = BLE(self.sensor.device_id)
+        ble.transport = self.sensor.transport
+        ble.rcvbuf = self.sensor.rcvbuf
+        ble.le_meta_only = self.sensor.le_meta_only
+        ble.whitelist = self.sensor.whitelist
+        ble.scan_profile = self.sensor.scan_profile
+        self.receiver = multiprocessing.Process(
+            target=_receive, args=(ble, self.rings, self.prefilter))
+        self.receiver.daemon = True
+        self.receiver.start()
+
+    def run(self):
+        # deliver results to sensor.on_message until the receiver ends
+        if self.receiver is None:
+            self.start()
+        deliver = self.sensor.dispatcher.put if self.sensor.dispatcher \
+            else self.sensor.on_message
+        running = self.workers
+        try:
+            while running:
+                batch = self.results.get()
+                if batch is None:
+                    running -= 1
+                    continue
+                for r in batch:
+                    deliver(r)
+                self.delivered += len(batch)
+        finally:
+            self.join()
+
+    def stop(self):
+        # end a live capture: the parent takes over as the rings' producer
+        if self.receiver is not None and self.receiver.is_alive():
+            self.receiver.terminate()
+            self.receiver.join()
+            for ring in self.rings:
+                ring.close_stream()
+
+    def join(self):
+        if self.receiver is not None:
+            self.receiver.join()
+        for p in self.processes:
+            p.join()
+        self.ring_stats = [ring.stats() for ring in self.rings]
+        for ring in self.rings:
+            ring.close(unlink=True)
+        self.rings = []
+        self.processes = []
+
+    def stats(self):
+        return {
+            'delivered': self.delivered,
+            'rings': [ring.stats() for ring in self.rings] or self.ring_stats,
+        }
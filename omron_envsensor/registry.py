@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import collections
+import copy
+import datetime
+
+
+class BeaconRegistry(object):
+    """
+    Latest state per sensor, keyed by bt_address.
+
+    The sensor rebroadcasts each reading many times with the same seq_num.
+    update() returns the beacon only when its seq_num differs from the last
+    one seen for that address, and None for repeats. Sensors not heard from
+    for `timeout` seconds are dropped, and at most `max_devices` sensors are
+    kept (least recently heard evicted first).
+
+    The registry keeps its own copy of each sensor's state, so beacons
+    already handed out are never changed afterwards.
+    """
+
+    def __init__(self, timeout=60, max_devices=1024, expire_interval=10):
+        self.timeout = datetime.timedelta(seconds=timeout)
+        self.max_devices = max_devices
+        self.expire_interval = datetime.timedelta(seconds=expire_interval)
+        self.devices = collections.OrderedDict()
+        self.last_expire = datetime.datetime.now()
+        self.emitted = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, bt_address):
+        return bt_address in self.devices
+
+    def get(self, bt_address):
+        return self.devices.get(bt_address)
+
+    def update(self, sensor_beacon):
+        now = sensor_beacon.tick_last_update
+        if now - self.last_expire >= self.expire_interval:
+            self.expire(now)
+
+        existing = self.devices.pop(sensor_beacon.bt_address, None)
+        if existing is not None and \
+                not existing.check_diff_seq_num(sensor_beacon):
+            existing.tick_last_update = now
+            existing.flag_active = True
+            self.devices[sensor_beacon.bt_address] = existing
+            self.duplicates += 1
+            return None
+
+        if existing is not None:
+            sensor_beacon.tick_register = existing.tick_register
+        self.devices[sensor_beacon.bt_address] = copy.copy(sensor_beacon)
+        while len(self.devices) > self.max_devices:
+            _, evicted = self.devices.popitem(last=False)
+            evicted.flag_active = False
+            self.evicted += 1
+        self.emitted += 1
+        return sensor_beacon
+
+    def expire(self, now=None):
+        """
+        Drop sensors silent for longer than timeout, returns their beacons.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        self.last_expire = now
+        expired = []
+        # least recently heard first
+        for bt_address, sensor_beacon in list(self.devices.items()):
+            if now - sensor_beacon.tick_last_update <= self.timeout:
+                break
+            del self.devices[bt_address]
+            sensor_beacon.flag_active = False
+            expired.append(sensor_beacon)
+        if expired:
+            logger.debug('expired %s', [b.bt_address for b in expired])
+        self.expired += len(expired)
+        return expired
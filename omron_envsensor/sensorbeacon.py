@@ -3,11 +3,13 @@ from __future__ import absolute_import
 from logging import getLogger
 logger = getLogger(__name__)
 
+import collections
 import math
 import sys
 import datetime
 import struct
 import json
+import operator
 
 from . import util
 from .ble import ADV_TYPE_MANUFACTURER_SPECIFIC_DATA, ADV_TYPE_SHORT_LOCAL_NAME
@@ -69,35 +71,146 @@ if sys.version > '3':
     verify_beacon_packet = verify_beacon_packet_3
 
 
-# Env Senor (OMRON 2JCIE-BL01 Broadcaster) ####################################
-class SensorBeacon:
-
-    # local fields from raw data
-    bt_address = ""
-    seq_num = 0
-    val_temp = 0.0
-    val_humi = 0.0
-    val_light = 0.0
-    val_uv = 0.0
-    val_pressure = 0.0
-    val_noise = 0.0
-    val_di = 0.0
-    val_heat = 0.0
-    val_ax = 0.0
-    val_ay = 0.0
-    val_az = 0.0
-    val_battery = 0.0
+# reasons for rejecting a report, see beacon_packet_reject_reason
+REJECT_LENGTH = 'length'
+REJECT_AD_TYPE = 'ad_type'
+REJECT_COMPANY_ID = 'company_id'
+REJECT_NAME = 'name'
 
-    rssi = -127
-    distance = 0
-    tick_last_update = 0
-    tick_register = 0
 
-    flag_active = False
+def beacon_packet_reject_reason(report):
+    # the first check of verify_beacon_packet that fails, None if none does
+    if report["report_metadata_length"] != 31:
+        return REJECT_LENGTH
+    payload = report["payload_binary"]
+    if util.c2B(payload[4]) != ADV_TYPE_MANUFACTURER_SPECIFIC_DATA:
+        return REJECT_AD_TYPE
+    if util.get_companyid(payload[5:7]) != COMPANY_ID:
+        return REJECT_COMPANY_ID
+    if util.c2B(payload[28]) != ADV_TYPE_SHORT_LOCAL_NAME or \
+            payload[29:31] not in (b'IM', b'EP'):
+        return REJECT_NAME
+    return None
+
+
+# Index Calc ###
+def discomfort_index_approximation(temp, humi):
+    return (0.81 * temp) + 0.01 * humi * ((0.99 * temp) - 14.3) + 46.3
+
+
+def wbgt_approximation(temp, humi, flag_outside=False):
+    wbgt = 0
+    if (temp < 0):
+        temp = 0
+    if (humi < 0):
+        humi = 0
+    if (humi > 100):
+        humi = 100
+    wbgt = (0.567 * temp) + 0.393 * (
+        humi / 100 * 6.105 * math.exp(
+            17.27 * temp / (237.7 + temp))) + 3.94
+    if not flag_outside:
+        wbgt = (wbgt + (1.1 * (1 - (humi / 62) * 1.6)) * (temp - 30) *
+                0.17 - abs(temp - 30) * 0.09) / 1.135
+    return wbgt
+
+
+def rssi_to_distance(rssi, power):  # rough distance in meter
+    RSSI = abs(rssi)
+    if RSSI == 0:
+        return -1
+    if power == 0:
+        return -1
+
+    ratio = RSSI * 1.0 / abs(power)
+    if ratio < 1.0:
+        return pow(ratio, 8.0)
+    accuracy = 0.69976 * pow(ratio, 7.7095) + 0.111
+    # accuracy = 0.89976 * pow(ratio, 7.7095) + 0.111
+    return accuracy
+
+
+class DistanceTable(object):
+    """
+    rssi_to_distance for every signed byte RSSI, rebuilt whenever it is
+    called with a different measured power.
+    """
+
+    def __init__(self):
+        self.power = None
+        self.table = None
+        self.rebuilds = 0
+
+    def __call__(self, rssi, power):
+        if power != self.power:
+            self.table = [rssi_to_distance(r, power) for r in range(-128, 128)]
+            self.power = power
+            self.rebuilds += 1
+        if -128 <= rssi < 128:
+            return self.table[rssi + 128]
+        return rssi_to_distance(rssi, power)
+
+
+class ComfortCache(object):
+    """
+    Bounded memo of (discomfort index, WBGT) keyed on the raw integer
+    temperature / humidity (0.01 units). Oldest entries go first when full.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, temp, humi):
+        key = (temp, humi)
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        if len(self.entries) >= self.maxsize:
+            self.entries.popitem(last=False)
+        temp = temp / 100.0
+        humi = humi / 100.0
+        value = self.entries[key] = (
+            discomfort_index_approximation(temp, humi),
+            wbgt_approximation(temp, humi, flag_outside=False))
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+        }
+
+
+distance_table = DistanceTable()
+comfort_indices = ComfortCache()
+
+
+# csv_format columns, in csv_header order
+CSV_FIELDS = ('tick_last_update', 'gateway', 'bt_address', 'sensor_type',
+              'rssi', 'distance', 'seq_num', 'val_battery', 'val_temp',
+              'val_humi', 'val_light', 'val_uv', 'val_pressure', 'val_noise',
+              'val_di', 'val_heat', 'val_ax', 'val_ay', 'val_az')
+CSV_ROW_FORMAT = ','.join(['%s'] * len(CSV_FIELDS))
+csv_row_fields = operator.attrgetter(*CSV_FIELDS)
 
-    sensor_type = "UNKNOWN"
-    gateway = "UNKNOWN"
 
+# Env Senor (OMRON 2JCIE-BL01 Broadcaster) ####################################
+class BaseSensorBeacon(object):
+    # decoding and formatting shared by SensorBeacon and CompactSensorBeacon
+    __slots__ = ()
 
     def __init__(self, bt_address_s, sensor_type_s, gateway_s, pkt):
         self.bt_address = bt_address_s
@@ -155,19 +268,62 @@ class SensorBeacon:
         self.gateway = gateway_s
 
 
-    def return_accuracy(self, rssi, power):  # rough distance in meter
-        RSSI = abs(rssi)
-        if RSSI == 0:
-            return -1
-        if power == 0:
-            return -1
+    @classmethod
+    def from_raw(cls, bt_address_s, sensor_type_s, gateway_s, seq_num,
+                 temp, humi, light, uv, pressure, noise, x, y, z, battery,
+                 rssi):
+        # build from already unpacked integer fields (see decoder.py)
+        self = cls.__new__(cls)
+        self.bt_address = bt_address_s
+        self.seq_num = seq_num
+
+        self.val_temp = temp / 100.0
+        self.val_humi = humi / 100.0
+        self.val_light = light
+        self.val_uv = uv / 100.0
+        self.val_pressure = pressure / 10.0
+        self.val_noise = noise / 100.0
+        self.val_battery = (battery + 100) * 10.0
 
-        ratio = RSSI * 1.0 / abs(power)
-        if ratio < 1.0:
-            return pow(ratio, 8.0)
-        accuracy = 0.69976 * pow(ratio, 7.7095) + 0.111
-        # accuracy = 0.89976 * pow(ratio, 7.7095) + 0.111
-        return accuracy
+        if sensor_type_s == "IM":
+            self.val_ax = x / 10.0
+            self.val_ay = y / 10.0
+            self.val_az = z / 10.0
+            self.val_di = 0.0
+            self.val_heat = 0.0
+            self.calc_factor()
+        elif sensor_type_s == "EP":
+            self.val_ax = 0.0
+            self.val_ay = 0.0
+            self.val_az = 0.0
+            self.val_di = x / 100.0
+            self.val_heat = y / 100.0
+        else:
+            self.val_ax = 0.0
+            self.val_ay = 0.0
+            self.val_az = 0.0
+            self.val_di = 0.0
+            self.val_heat = 0.0
+            self.calc_factor()
+
+        self.rssi = rssi
+        self.distance = self.return_accuracy(
+            self.rssi, BEACON_MEASURED_POWER)
+
+        self.tick_register = datetime.datetime.now()
+        self.tick_last_update = self.tick_register
+        self.flag_active = True
+
+        self.sensor_type = sensor_type_s
+        self.gateway = gateway_s
+        return self
+
+
+    def return_accuracy(self, rssi, power):  # rough distance in meter
+        table = distance_table
+        if power == table.power and -128 <= rssi < 128:
+            return table.table[rssi + 128]
+        return table(rssi, power)
 
 
     def check_diff_seq_num(self, sensor_beacon):
@@ -202,32 +358,9 @@ class SensorBeacon:
 
 
     def calc_factor(self):
-        self.val_di = self.__discomfort_index_approximation(
-            self.val_temp, self.val_humi)
-        self.val_heat = self.__wbgt_approximation(
-            self.val_temp, self.val_humi, flag_outside=False)
-
-
-    # Index Calc ###
-    def __discomfort_index_approximation(self, temp, humi):
-        return (0.81 * temp) + 0.01 * humi * ((0.99 * temp) - 14.3) + 46.3
-
-
-    def __wbgt_approximation(self, temp, humi, flag_outside=False):
-        wbgt = 0
-        if (temp < 0):
-            temp = 0
-        if (humi < 0):
-            humi = 0
-        if (humi > 100):
-            humi = 100
-        wbgt = (0.567 * temp) + 0.393 * (
-            humi / 100 * 6.105 * math.exp(
-                17.27 * temp / (237.7 + temp))) + 3.94
-        if not flag_outside:
-            wbgt = (wbgt + (1.1 * (1 - (humi / 62) * 1.6)) * (temp - 30) *
-                    0.17 - abs(temp - 30) * 0.09) / 1.135
-        return wbgt
+        # val_temp / val_humi are the raw 0.01 unit readings / 100.0
+        self.val_di, self.val_heat = comfort_indices(
+            int(round(self.val_temp * 100)), int(round(self.val_humi * 100)))
 
 
     def debug_print(self, logger=logger):
@@ -255,26 +388,7 @@ class SensorBeacon:
 
 
     def csv_format(self):
-        str_data = str(self.tick_last_update) + "," + \
-                   str(self.gateway) + "," + \
-                   str(self.bt_address) + "," + \
-                   str(self.sensor_type) + "," + \
-                   str(self.rssi) + "," + \
-                   str(self.distance) + "," + \
-                   str(self.seq_num) + "," + \
-                   str(self.val_battery) + "," + \
-                   str(self.val_temp) + "," + \
-                   str(self.val_humi) + "," + \
-                   str(self.val_light) + "," + \
-                   str(self.val_uv) + "," + \
-                   str(self.val_pressure) + "," + \
-                   str(self.val_noise) + "," + \
-                   str(self.val_di) + "," + \
-                   str(self.val_heat) + "," + \
-                   str(self.val_ax) + "," + \
-                   str(self.val_ay) + "," + \
-                   str(self.val_az)
-        return str_data
+        return CSV_ROW_FORMAT % csv_row_fields(self)
 
 
     def json_format(self):
@@ -301,6 +415,178 @@ class SensorBeacon:
         })
 
 
+class SensorBeacon(BaseSensorBeacon):
+
+    # local fields from raw data
+    bt_address = ""
+    seq_num = 0
+    val_temp = 0.0
+    val_humi = 0.0
+    val_light = 0.0
+    val_uv = 0.0
+    val_pressure = 0.0
+    val_noise = 0.0
+    val_di = 0.0
+    val_heat = 0.0
+    val_ax = 0.0
+    val_ay = 0.0
+    val_az = 0.0
+    val_battery = 0.0
+
+    rssi = -127
+    distance = 0
+    tick_last_update = 0
+    tick_register = 0
+
+    flag_active = False
+
+    sensor_type = "UNKNOWN"
+    gateway = "UNKNOWN"
+    # device id of the adapter that heard it (multi.MultiOmronEnvSensor)
+    adapter = None
+
+
+# seq, temp, humi, light, uv, pressure, noise, accel x / di,
+# accel y / heat, accel z, battery, rssi
+COMPACT_RECORD = struct.Struct("<BhHHHHHhhhBb")
+# the same measurement fields at offset 7 of payload_binary
+_PAYLOAD_FIELDS = struct.Struct("<BhHHHHHhhhB")
+
+
+def raw_fields(sensor_beacon):
+    """
+    The unscaled COMPACT_RECORD fields of a beacon: seq, temp, humi, light,
+    uv, pressure, noise, accel x / di, accel y / heat, accel z, battery, rssi.
+    """
+    raw = getattr(sensor_beacon, '_raw', None)
+    if raw is not None:
+        return COMPACT_RECORD.unpack(raw)
+    if sensor_beacon.sensor_type == "EP":
+        x = int(round(sensor_beacon.val_di * 100))
+        y = int(round(sensor_beacon.val_heat * 100))
+        z = 0
+    else:
+        x = int(round(sensor_beacon.val_ax * 10))
+        y = int(round(sensor_beacon.val_ay * 10))
+        z = int(round(sensor_beacon.val_az * 10))
+    return (sensor_beacon.seq_num,
+            int(round(sensor_beacon.val_temp * 100)),
+            int(round(sensor_beacon.val_humi * 100)),
+            int(sensor_beacon.val_light),
+            int(round(sensor_beacon.val_uv * 100)),
+            int(round(sensor_beacon.val_pressure * 10)),
+            int(round(sensor_beacon.val_noise * 100)),
+            x, y, z,
+            int(round(sensor_beacon.val_battery / 10.0)) - 100,
+            sensor_beacon.rssi)
+
+
+def _field(fmt, offset):
+    s = struct.Struct("<" + fmt)
+    return lambda raw: s.unpack_from(raw, offset)[0]
+
+_seq_num = _field("B", 0)
+_temp = _field("h", 1)
+_humi = _field("H", 3)
+_light = _field("H", 5)
+_uv = _field("H", 7)
+_pressure = _field("H", 9)
+_noise = _field("H", 11)
+_x = _field("h", 13)
+_y = _field("h", 15)
+_z = _field("h", 17)
+_battery = _field("B", 19)
+_rssi = _field("b", 20)
+
+
+class CompactSensorBeacon(BaseSensorBeacon):
+    # Read-only stand-in for SensorBeacon. The measurement stays packed in a
+    # COMPACT_RECORD and is scaled on access, so a record costs one small
+    # bytes object instead of a __dict__ of floats.
+    __slots__ = ('_raw', 'bt_address', 'sensor_type', 'gateway',
+                 'tick_register', 'tick_last_update', 'flag_active',
+                 'adapter')
+
+    def __init__(self, bt_address_s, sensor_type_s, gateway_s, pkt):
+        self._set(bt_address_s, sensor_type_s, gateway_s,
+                  _PAYLOAD_FIELDS.unpack_from(pkt, 7) + (util.c2b(pkt[-1]),))
+
+    @classmethod
+    def from_raw(cls, bt_address_s, sensor_type_s, gateway_s, *fields):
+        self = cls.__new__(cls)
+        self._set(bt_address_s, sensor_type_s, gateway_s, fields)
+        return self
+
+    @classmethod
+    def from_beacon(cls, sensor_beacon):
+        self = cls.from_raw(
+            sensor_beacon.bt_address, sensor_beacon.sensor_type,
+            sensor_beacon.gateway, *raw_fields(sensor_beacon))
+        self.tick_register = sensor_beacon.tick_register
+        self.tick_last_update = sensor_beacon.tick_last_update
+        self.flag_active = sensor_beacon.flag_active
+        self.adapter = sensor_beacon.adapter
+        return self
+
+    def _set(self, bt_address_s, sensor_type_s, gateway_s, fields):
+        self._raw = COMPACT_RECORD.pack(*fields)
+        self.bt_address = bt_address_s
+        self.sensor_type = sensor_type_s
+        self.gateway = gateway_s
+        self.tick_register = datetime.datetime.now()
+        self.tick_last_update = self.tick_register
+        self.flag_active = True
+        self.adapter = None
+
+    seq_num = property(lambda self: _seq_num(self._raw))
+    val_temp = property(lambda self: _temp(self._raw) / 100.0)
+    val_humi = property(lambda self: _humi(self._raw) / 100.0)
+    val_light = property(lambda self: _light(self._raw))
+    val_uv = property(lambda self: _uv(self._raw) / 100.0)
+    val_pressure = property(lambda self: _pressure(self._raw) / 10.0)
+    val_noise = property(lambda self: _noise(self._raw) / 100.0)
+    val_battery = property(lambda self: (_battery(self._raw) + 100) * 10.0)
+    rssi = property(lambda self: _rssi(self._raw))
+
+    @property
+    def val_ax(self):
+        if self.sensor_type != "IM":
+            return 0.0
+        return _x(self._raw) / 10.0
+
+    @property
+    def val_ay(self):
+        if self.sensor_type != "IM":
+            return 0.0
+        return _y(self._raw) / 10.0
+
+    @property
+    def val_az(self):
+        if self.sensor_type != "IM":
+            return 0.0
+        return _z(self._raw) / 10.0
+
+    @property
+    def val_di(self):
+        if self.sensor_type == "EP":
+            return _x(self._raw) / 100.0
+        return comfort_indices(_temp(self._raw), _humi(self._raw))[0]
+
+    @property
+    def val_heat(self):
+        if self.sensor_type == "EP":
+            return _y(self._raw) / 100.0
+        return comfort_indices(_temp(self._raw), _humi(self._raw))[1]
+
+    @property
+    def distance(self):
+        return self.return_accuracy(self.rssi, BEACON_MEASURED_POWER)
+
+    def calc_factor(self):
+        # val_di / val_heat are derived on access
+        pass
+
+
 def csv_header():
     str_head = "Time" + "," + \
                "Gateway" + "," + \
@@ -0,0 +1,151 @@
+"""
+batch JSON serialization of beacons
+
+Turns a list of beacons into one NDJSON chunk or one JSON array in a single
+pass. Without precision / fields every line equals SensorBeacon.json_format(),
+except that missing and non-finite numbers (None, nan, inf) are written as
+null, as JSON has no literal for them.
+"""
+from __future__ import absolute_import
+
+import json
+import operator
+
+
+# (JSON key, beacon attribute) in json_format order
+JSON_FIELDS = (
+    ('tick_last_update', 'tick_last_update'),
+    ('gateway', 'gateway'),
+    ('address', 'bt_address'),
+    ('sensor_type', 'sensor_type'),
+    ('rssi', 'rssi'),
+    ('distance', 'distance'),
+    ('seq_num', 'seq_num'),
+    ('battery', 'val_battery'),
+    ('temp', 'val_temp'),
+    ('humi', 'val_humi'),
+    ('light', 'val_light'),
+    ('uv', 'val_uv'),
+    ('pressure', 'val_pressure'),
+    ('noise', 'val_noise'),
+    ('di', 'val_di'),
+    ('heat', 'val_heat'),
+    ('ax', 'val_ax'),
+    ('ay', 'val_ay'),
+    ('az', 'val_az'),
+)
+
+_STRING_KEYS = ('gateway', 'address', 'sensor_type')
+
+
+_INT_KEYS = ('rssi', 'seq_num', 'light')
+
+
+class JSONSerializer(object):
+    """
+    fields limits the output to the given JSON keys (in JSON_FIELDS order),
+    precision formats floats with that many decimals instead of repr.
+    """
+
+    def __init__(self, fields=None, precision=None):
+        if fields is None:
+            selected = JSON_FIELDS
+        else:
+            unknown = set(fields) - set(key for key, _ in JSON_FIELDS)
+            if unknown:
+                raise ValueError('unknown fields %s' % sorted(unknown))
+            selected = [f for f in JSON_FIELDS if f[0] in fields]
+        self.fields = [key for key, _ in selected]
+        self.precision = precision
+        self._strings = {}
+
+        # the tick and string fields come first in JSON_FIELDS, numbers
+        # follow and go straight into the precompiled format
+        fragments = []
+        text_fragments = []
+        self.tick = False
+        self.string_attrs = []
+        number_attrs = []
+        # per number field format, for lines that need null
+        self.number_formats = []
+        for key, attr in selected:
+            if key == 'tick_last_update':
+                self.tick = True
+                fragment = text = '"%s": "%%s"' % key
+            elif key in _STRING_KEYS:
+                self.string_attrs.append(attr)
+                fragment = text = '"%s": %%s' % key
+            else:
+                number_attrs.append(attr)
+                if precision is None or key in _INT_KEYS:
+                    self.number_formats.append('%r')
+                else:
+                    self.number_formats.append('%%.%df' % precision)
+                fragment = '"%s": %s' % (key, self.number_formats[-1])
+                text = '"%s": %%s' % key
+            fragments.append(fragment)
+            text_fragments.append(text)
+        self.format = '{' + ', '.join(fragments) + '}'
+        # the same line with every number pre-formatted as text
+        self.text_format = '{' + ', '.join(text_fragments) + '}'
+        self.numbers = _getter(number_attrs)
+        self.strings = _getter(self.string_attrs)
+
+    def _encode_strings(self, values):
+        # gateway / address / type repeat, so encode each combination once
+        encoded = self._strings.get(values)
+        if encoded is None:
+            encoded = self._strings[values] = tuple(
+                json.dumps(v) for v in values)
+        return encoded
+
+    def _null_line(self, head, numbers):
+        return self.text_format % (head + tuple(
+            'null' if not _finite(v) else f % v
+            for f, v in zip(self.number_formats, numbers)))
+
+    def line(self, sensor_beacon):
+        head = self._encode_strings(self.strings(sensor_beacon))
+        if self.tick:
+            head = (sensor_beacon.tick_last_update.isoformat(),) + head
+        numbers = self.numbers(sensor_beacon)
+        # one C level pass: the sum is nan/inf (or a TypeError for None)
+        # only when some value is, or in the rare overflow case
+        try:
+            total = sum(numbers)
+            if total - total != 0:
+                return self._null_line(head, numbers)
+        except TypeError:
+            return self._null_line(head, numbers)
+        return self.format % (head + numbers)
+
+    def ndjson(self, beacons):
+        lines = [self.line(b) for b in beacons]
+        if not lines:
+            return ''
+        return '\n'.join(lines) + '\n'
+
+    def array(self, beacons):
+        return '[' + ', '.join([self.line(b) for b in beacons]) + ']'
+
+
+def _finite(value):
+    return value is not None and value - value == 0
+
+
+def _getter(attrs):
+    # attrgetter that always returns a tuple
+    if not attrs:
+        return lambda beacon: ()
+    if len(attrs) == 1:
+        getter = operator.attrgetter(attrs[0])
+        return lambda beacon: (getter(beacon),)
+    return operator.attrgetter(*attrs)
+
+
+def to_ndjson(beacons, fields=None, precision=None):
+    return JSONSerializer(fields, precision).ndjson(beacons)
+
+
+def to_json_array(beacons, fields=None, precision=None):
+    return JSONSerializer(fields, precision).array(beacons)
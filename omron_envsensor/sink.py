@@ -0,0 +1,153 @@
+"""
+output sinks for decoded beacons
+
+A sink is called with each beacon, so it can be used as on_message
+directly:
+
+    sensor.on_message = CSVSink('/var/log/omron/%Y%m%d.csv')
+"""
+from __future__ import absolute_import
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+import os
+import threading
+import time
+
+from .sensorbeacon import CSV_ROW_FORMAT, csv_row_fields, csv_header
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+
+class CSVSink(object):
+    """
+    Buffered CSV writer with rotation.
+
+    `path` is a strftime pattern evaluated on each beacon's
+    tick_last_update, so a pattern containing the date starts a new file
+    every day; a file object (e.g. sys.stdout) is written as is without
+    rotation. Files over max_bytes roll over to '<name>.1', '<name>.2', ...
+    Rows are buffered and written once flush_bytes are pending, and at
+    the latest flush_interval seconds after they were buffered (a timer
+    thread writes them out when no further beacon arrives). The
+    csv_header line opens every new file.
+    """
+
+    def __init__(self, path, max_bytes=None, flush_bytes=65536,
+                 flush_interval=5.0, newline='\r\n', header=True):
+        self.pattern = None
+        self.file = None
+        if isinstance(path, string_types):
+            self.pattern = path
+        else:
+            self.file = path
+        self.max_bytes = max_bytes
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.newline = newline
+        self.header = header
+        self.row_format = CSV_ROW_FORMAT + newline
+
+        self.filename = None
+        self.file_size = 0
+        self.base = None
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.time()
+        self.rows = 0
+        self.files = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+        if self.file is not None and header:
+            self._write_header()
+
+    def write(self, sensor_beacon):
+        with self.lock:
+            if self.pattern is not None:
+                base = sensor_beacon.tick_last_update.strftime(self.pattern)
+                if base != self.base or (
+                        self.max_bytes and
+                        self.file_size + self.buffered >= self.max_bytes):
+                    self._rotate(base)
+            row = self.row_format % csv_row_fields(sensor_beacon)
+            self.buffer.append(row)
+            self.buffered += len(row)
+            self.rows += 1
+            if self.buffered >= self.flush_bytes or \
+                    time.time() - self.last_flush >= self.flush_interval:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval,
+                                             self._timed_flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    __call__ = write
+
+    def _timed_flush(self):
+        with self.lock:
+            self.timer = None
+            if self.file is not None:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.file_size += self._write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        if self.file is not None:
+            self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._flush()
+            if self.pattern is not None and self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _rotate(self, base):
+        self._flush()
+        if self.file is not None:
+            self.file.close()
+        self.base = base
+        directory = os.path.dirname(base)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        index = 0
+        filename = base
+        while self.max_bytes and os.path.exists(filename) and \
+                os.path.getsize(filename) >= self.max_bytes:
+            index += 1
+            filename = '%s.%d' % (base, index)
+        self.filename = filename
+        # binary, so rows go out byte for byte on Python 2 and 3
+        self.file = open(filename, 'ab')
+        self.file_size = self.file.tell()
+        self.files += 1
+        logger.debug('writing %s', filename)
+        if self.header and self.file_size == 0:
+            self._write_header()
+
+    def _write(self, data):
+        # rotated files are binary; file objects get native str as is
+        if self.pattern is not None and not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.file.write(data)
+        return len(data)
+
+    def _write_header(self):
+        self.file_size += self._write(csv_header() + self.newline)
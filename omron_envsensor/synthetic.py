@@ -0,0 +1,123 @@
+"""
+synthetic HCI LE advertising traffic
+
+Generates raw HCI event frames, as read from the HCI socket, mixing Omron
+IM / EP beacons with foreign adverts, for benchmarks and replay tests.
+"""
+from __future__ import absolute_import
+
+import random
+import struct
+
+from .ble import EVT_LE_META_EVENT, EVT_LE_ADVERTISING_REPORT, \
+    LE_ADV_IND, LE_ADV_NONCONN_IND, LE_ADV_SCAN_IND, LE_ADV_SCAN_RSP, \
+    LE_PUBLIC_ADDRESS, LE_RANDOM_ADDRESS
+from .sensorbeacon import COMPANY_ID
+
+HCI_EVENT_PKT = 0x04
+
+
+def omron_payload(rnd, sensor_type=b'IM', seq_num=0):
+    # 31 byte advertising data of a 2JCIE-BL01 in IM or EP mode
+    data = bytearray(31)
+    data[0:3] = b'\x02\x01\x06'                      # flags
+    data[3:5] = b'\x19\xff'                          # manufacturer data
+    data[5:7] = struct.pack('<H', COMPANY_ID)
+    data[7] = seq_num & 0xFF
+    struct.pack_into('<hHHHHH', data, 8,
+                     rnd.randrange(-1000, 4000),     # temp
+                     rnd.randrange(2000, 9000),      # humi
+                     rnd.randrange(0, 2000),         # light
+                     rnd.randrange(0, 1200),         # uv
+                     rnd.randrange(9500, 10300),     # pressure
+                     rnd.randrange(3500, 8000))      # noise
+    if sensor_type == b'IM':
+        struct.pack_into('<hhh', data, 20, rnd.randrange(-20, 20),
+                         rnd.randrange(-20, 20), rnd.randrange(990, 1010))
+    else:
+        struct.pack_into('<hh', data, 20, rnd.randrange(5000, 8000),
+                         rnd.randrange(1000, 3000))
+    data[26] = rnd.randrange(150, 220)               # battery
+    data[27:31] = b'\x03\x08' + sensor_type          # shortened local name
+    return bytes(data)
+
+
+def foreign_payload(rnd):
+    # typical non-Omron adverts: iBeacon, Eddystone, phones and tags
+    kind = rnd.randrange(4)
+    if kind == 0:
+        data = b'\x02\x01\x06\x1a\xff\x4c\x00\x02\x15' + \
+            bytes(bytearray(rnd.randrange(256) for _ in range(21)))
+    elif kind == 1:
+        data = b'\x02\x01\x06\x03\x03\xaa\xfe\x11\x16\xaa\xfe\x10' + \
+            bytes(bytearray(rnd.randrange(256) for _ in range(14)))
+    elif kind == 2:
+        data = b'\x02\x01\x1a\x0b\xff\x4c\x00\x10\x06' + \
+            bytes(bytearray(rnd.randrange(256) for _ in range(8)))
+    else:
+        data = bytes(bytearray(rnd.randrange(256)
+                               for _ in range(rnd.randrange(0, 32))))
+    return data
+
+
+def adv_report(address, data, rssi, event_type=LE_ADV_NONCONN_IND,
+               address_type=LE_RANDOM_ADDRESS):
+    return struct.pack('<BB6sB', event_type, address_type, address,
+                       len(data)) + data + struct.pack('<b', rssi)
+
+
+def le_meta_frame(reports):
+    body = struct.pack('<BB', EVT_LE_ADVERTISING_REPORT, len(reports)) + \
+        b''.join(reports)
+    return struct.pack('<BBB', HCI_EVENT_PKT, EVT_LE_META_EVENT,
+                       len(body)) + body
+
+
+class TrafficGenerator(object):
+    """
+    Reproducible stream of HCI LE advertising frames.
+
+    foreign_ratio is the share of foreign reports, multi_ratio the share of
+    events carrying 2..max_reports reports.
+    """
+
+    def __init__(self, sensors=20, foreign_devices=200, foreign_ratio=0.9,
+                 multi_ratio=0.1, max_reports=3, seed=0):
+        self.rnd = random.Random(seed)
+        self.foreign_ratio = foreign_ratio
+        self.multi_ratio = multi_ratio
+        self.max_reports = max_reports
+        self.sensors = [
+            (self._address(), self.rnd.choice([b'IM', b'EP']))
+            for _ in range(sensors)]
+        self.seq_nums = [0] * sensors
+        self.foreign = [self._address() for _ in range(foreign_devices)]
+
+    def _address(self):
+        return bytes(bytearray(self.rnd.randrange(256) for _ in range(6)))
+
+    def report(self):
+        rnd = self.rnd
+        rssi = rnd.randrange(-100, -30)
+        if not self.sensors or rnd.random() < self.foreign_ratio:
+            return adv_report(
+                rnd.choice(self.foreign), foreign_payload(rnd), rssi,
+                rnd.choice([LE_ADV_IND, LE_ADV_SCAN_IND, LE_ADV_SCAN_RSP,
+                            LE_ADV_NONCONN_IND]),
+                rnd.choice([LE_PUBLIC_ADDRESS, LE_RANDOM_ADDRESS]))
+        i = rnd.randrange(len(self.sensors))
+        address, sensor_type = self.sensors[i]
+        # a sensor repeats each reading several times before the next seq
+        if rnd.random() < 0.2:
+            self.seq_nums[i] = (self.seq_nums[i] + 1) & 0xFF
+        return adv_report(address, omron_payload(
+            rnd, sensor_type, self.seq_nums[i]), rssi)
+
+    def frame(self):
+        count = 1
+        if self.max_reports > 1 and self.rnd.random() < self.multi_ratio:
+            count = self.rnd.randrange(2, self.max_reports + 1)
+        return le_meta_frame([self.report() for _ in range(count)])
+
+    def frames(self, count):
+        return [self.frame() for _ in range(count)]
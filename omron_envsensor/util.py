@@ -1,28 +1,118 @@
 from logging import getLogger
 logger = getLogger(__name__)
 
+import datetime
 import struct
 import sys
 import os
+import time
+
+# clock for latency measurements
+timer = getattr(time, 'perf_counter', time.time)
+
+_HEX_BYTES = ['%02X' % i for i in range(256)]
+
 
 def packet_as_hex_string(pkt, flag_with_spacing=False,
                          flag_force_capitalize=False):
-    packet = []
+    # digits are always upper case; flag_force_capitalize is kept for callers
     space = ""
     if (flag_with_spacing):
         space = " "
+    return space.join([_HEX_BYTES[b] for b in bytearray(pkt)])
+
+
+class LazyHexDict(dict):
+    """
+    dict whose hex string fields are rendered on first access only.
+
+    Deferred keys behave like ordinary ones: iterating, listing items,
+    copying, comparing or printing the dict renders them first.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LazyHexDict, self).__init__(*args, **kwargs)
+        self._deferred = {}
+
+    def defer_hex(self, key, pkt, **kwargs):
+        dict.pop(self, key, None)
+        self._deferred[key] = (pkt, kwargs)
+
+    def render(self):
+        # build every deferred string now; a value assigned since wins
+        for key in list(self._deferred):
+            if dict.__contains__(self, key):
+                del self._deferred[key]
+            else:
+                self[key]
+        return self
+
+    def __missing__(self, key):
+        if key not in self._deferred:
+            raise KeyError(key)
+        pkt, kwargs = self._deferred.pop(key)
+        value = self[key] = packet_as_hex_string(pkt, **kwargs)
+        return value
+
+    def __delitem__(self, key):
+        if key in self._deferred:
+            self.render()
+        dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._deferred
+
+    def __len__(self):
+        return dict.__len__(self.render())
 
-    for b in pkt:
-        if sys.version < '3':
-            b = struct.unpack("<B", b)[0]
+    def __iter__(self):
+        return dict.__iter__(self.render())
 
-        packet.append('{0:02X}'.format(b))
+    def __eq__(self, other):
+        return dict.__eq__(self.render(), other)
 
-    packet = space.join(packet)
-    if (flag_force_capitalize):
-        packet = packet.upper()
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return dict.__repr__(self.render())
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return dict.keys(self.render())
+
+    def values(self):
+        return dict.values(self.render())
+
+    def items(self):
+        return dict.items(self.render())
+
+    def pop(self, key, *default):
+        if key in self._deferred:
+            self.render()
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        return dict.popitem(self.render())
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def copy(self):
+        return dict(self.render())
+
+    def __reduce__(self):
+        return (dict, (dict(self.render()),))
 
-    return packet
 
 def packed_bdaddr_to_string(bdaddr_packed):
     return ':'.join('%02x' % i for i in struct.unpack("<BBBBBB", bdaddr_packed[::-1]))
@@ -105,5 +195,11 @@ def ushort2short(val):
         short_val = val
     return short_val
 
+def to_epoch(tick):
+    # local naive datetime (tick_last_update) or epoch seconds
+    if isinstance(tick, datetime.datetime):
+        return time.mktime(tick.timetuple()) + tick.microsecond / 1000000.0
+    return float(tick)
+
 def getHostname():
     return os.uname()[1]
@@ -4,10 +4,12 @@ from logging import getLogger
 logger = getLogger('omron_envsensor')
 
 from omron_envsensor import OmronEnvSensor
+from omron_envsensor.multi import MultiOmronEnvSensor
 from omron_envsensor.util import getHostname
 import sys
 import os
 
+# one adapter id, or several separated by commas (e.g. "0,1")
 BLUETHOOTH_DEVICEID = os.environ.get('BLUETHOOTH_DEVICEID', 0)
 
 def main():
@@ -16,7 +18,11 @@ def main():
     logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 
     before_seq = None
-    o = OmronEnvSensor(getHostname(), BLUETHOOTH_DEVICEID)
+    device_ids = [int(i) for i in str(BLUETHOOTH_DEVICEID).split(',')]
+    if len(device_ids) > 1:
+        o = MultiOmronEnvSensor(getHostname(), device_ids)
+    else:
+        o = OmronEnvSensor(getHostname(), device_ids[0])
 
     def callback(beacon):
         beacon.debug_print(logger)
@@ -24,7 +30,10 @@ def main():
 
     o.on_message = callback
     o.init()
-    o.loop()
+    try:
+        o.loop()
+    finally:
+        o.close()
 
 if __name__ == '__main__':
     main()
@@ -5,6 +5,9 @@ setup(
     name = "omron_envsensor",
     version = omron_envsensor.__version__,
     description = ("OMRON 2JCIE-BL01 SENSOR"),
+    extras_require={
+        'batch' : ['numpy'],
+    },
     entry_points={
         'console_scripts' : [
             'omron_env = run:main',
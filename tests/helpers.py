@@ -0,0 +1,26 @@
+from __future__ import absolute_import
+
+import datetime
+
+from omron_envsensor import OmronEnvSensor
+from omron_envsensor.synthetic import TrafficGenerator
+
+
+def make_beacons(count, sensors=1, seed=0):
+    # decoded SensorBeacons from synthetic Omron-only traffic
+    sensor = OmronEnvSensor('test', 0)
+    generator = TrafficGenerator(sensors=sensors, foreign_ratio=0,
+                                 multi_ratio=0, seed=seed)
+    beacons = []
+    for frame in generator.frames(count):
+        beacons.extend(sensor.decode(frame))
+    return beacons
+
+
+def at(sensor_beacon, when):
+    sensor_beacon.tick_register = when
+    sensor_beacon.tick_last_update = when
+    return sensor_beacon
+
+
+T0 = datetime.datetime(2024, 1, 1, 13, 40)
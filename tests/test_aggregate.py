@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+
+import datetime
+import unittest
+
+from omron_envsensor.aggregate import WindowAggregator
+
+from .helpers import T0, at, make_beacons
+
+
+def seconds(n):
+    return datetime.timedelta(seconds=n)
+
+
+class WindowAggregatorTest(unittest.TestCase):
+
+    def test_tumbling_window_summary(self):
+        beacons = make_beacons(3)
+        aggregator = WindowAggregator(window=60)
+        for i, b in enumerate(beacons):
+            self.assertEqual(aggregator.add(at(b, T0 + seconds(10 * i))), [])
+        summaries = aggregator.add(at(make_beacons(1)[0], T0 + seconds(60)))
+        self.assertEqual(len(summaries), 1)
+        summary = summaries[0]
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['start'], T0)
+        self.assertEqual(summary['end'], T0 + seconds(60))
+        temps = [b.val_temp for b in beacons]
+        self.assertEqual(summary['temp']['min'], min(temps))
+        self.assertEqual(summary['temp']['max'], max(temps))
+        self.assertAlmostEqual(summary['temp']['mean'], sum(temps) / 3)
+        self.assertEqual(summary['temp']['last'], temps[-1])
+
+    def test_sliding_windows_emitted_once(self):
+        first, second = make_beacons(2)
+        aggregator = WindowAggregator(window=300, step=60)
+        aggregator.add(at(first, T0))
+        ends = [s['end'] for s in aggregator.flush(T0 + seconds(130))]
+        self.assertEqual(ends, [T0 + seconds(60), T0 + seconds(120)])
+        self.assertEqual(aggregator.flush(T0 + seconds(130)), [])
+        ends = [s['end'] for s in aggregator.add(at(second, T0 + seconds(200)))]
+        self.assertEqual(ends, [T0 + seconds(180)])
+        ends = [s['end'] for s in aggregator.close()]
+        self.assertEqual(ends, [T0 + seconds(240 + 60 * i) for i in range(5)])
+        self.assertEqual(aggregator.summaries, 8)
+
+    def test_every_reading_counted_once_per_window(self):
+        aggregator = WindowAggregator(window=120, step=60)
+        summaries = []
+        for i, b in enumerate(make_beacons(10)):
+            summaries.extend(aggregator.add(at(b, T0 + seconds(30 * i))))
+        summaries.extend(aggregator.close())
+        # each reading lands in window / step = 2 windows
+        self.assertEqual(sum(s['count'] for s in summaries), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+
+import errno
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+from omron_envsensor import OmronEnvSensor, btsnoop
+from omron_envsensor.synthetic import TrafficGenerator
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from omron_envsensor.aio import stream
+
+
+class FailingSocket(object):
+    # readable socketpair end whose recv fails like an unplugged adapter
+
+    def __init__(self):
+        self.peer, self.sock = socket.socketpair()
+        self.peer.send(b'\0')
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def setblocking(self, flag):
+        pass
+
+    def recv(self, bufsize, flags=0):
+        raise OSError(errno.ENODEV, 'No such device')
+
+    def close(self):
+        self.peer.close()
+        self.sock.close()
+
+
+class Transport(object):
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def open(self, ble):
+        return self.sock
+
+
+def collect(sensor, limit=None):
+    async def consume():
+        out = []
+        async for r in stream(sensor):
+            out.append(r)
+            if limit is not None and len(out) >= limit:
+                break
+        return out
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(
+            asyncio.wait_for(consume(), timeout=10))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio stream needs 3.5+')
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'capture.btsnoop')
+        self.frames = TrafficGenerator(foreign_ratio=0.5).frames(300)
+        writer = btsnoop.BtsnoopWriter(self.path)
+        for frame in self.frames:
+            writer.write(frame)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sensor(self, transport):
+        sensor = OmronEnvSensor('test', 0)
+        sensor.transport = transport
+        return sensor
+
+    def test_replay_ends_at_end_of_capture(self):
+        sensor = self.sensor(btsnoop.ReplayTransport(self.path))
+        expected = sum(len(sensor.decode(f)) for f in self.frames)
+        self.assertEqual(len(collect(sensor)), expected)
+
+    def test_realtime_replay(self):
+        sensor = self.sensor(
+            btsnoop.ReplayTransport(self.path, realtime=True, speed=1000.0))
+        self.assertEqual(len(collect(sensor, limit=5)), 5)
+        sensor.sock.close()
+
+    def test_receive_error_reaches_consumer(self):
+        sock = FailingSocket()
+        sensor = self.sensor(Transport(sock))
+        with self.assertRaises(OSError) as raised:
+            collect(sensor)
+        self.assertEqual(raised.exception.errno, errno.ENODEV)
+        sock.close()
+
+    def test_decode_error_reaches_consumer(self):
+        sensor = self.sensor(btsnoop.ReplayTransport(self.path))
+
+        def decode(pkt):
+            raise ValueError('bad frame')
+        sensor.decode = decode
+        with self.assertRaises(ValueError):
+            collect(sensor)
+
+
+if __name__ == '__main__':
+    unittest.main()
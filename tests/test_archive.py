@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from omron_envsensor import archive
+from omron_envsensor.archive import ArchiveSink, ArchiveReader, ARCHIVE_RECORD
+
+from .helpers import T0, at, make_beacons
+
+
+def minutes(n):
+    return datetime.timedelta(minutes=n)
+
+
+@unittest.skipIf(archive.np is None, 'reading archives requires numpy')
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.arc')
+        self.beacons = make_beacons(40, sensors=2)
+        self.address = self.beacons[0].bt_address
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, beacons, start):
+        sink = ArchiveSink(self.path)
+        for i, b in enumerate(beacons):
+            sink(at(b, start + minutes(i)))
+        sink.close()
+
+    def expected(self, beacons):
+        return sum(1 for b in beacons if b.bt_address == self.address)
+
+    def test_reopen_within_block(self):
+        self.write(self.beacons[:10], T0)
+        self.write(self.beacons[10:20], T0 + minutes(10))
+        reader = ArchiveReader(self.path)
+        self.assertEqual(len(reader), 20)
+        self.assertEqual(len(reader.query(self.address)),
+                         self.expected(self.beacons[:20]))
+        self.assertEqual(
+            len(reader.query(self.address, T0, T0 + minutes(60))),
+            self.expected(self.beacons[:20]))
+        self.assertEqual(len(reader.query(None, T0 + minutes(5),
+                                          T0 + minutes(15))), 10)
+
+    def test_clock_stepping_back(self):
+        self.write(self.beacons[:10], T0 + minutes(120))
+        self.write(self.beacons[10:20], T0)
+        reader = ArchiveReader(self.path)
+        self.assertEqual(len(reader.query(None, T0, T0 + minutes(60))), 10)
+        self.assertEqual(len(reader.query(self.address)),
+                         self.expected(self.beacons[:20]))
+
+    def test_partial_trailing_record(self):
+        self.write(self.beacons[:10], T0)
+        with open(self.path, 'ab') as f:
+            f.write(b'\x01' * (ARCHIVE_RECORD.size // 2))
+        with open(self.path + '.idx', 'ab') as f:
+            f.write(b'\x01' * 5)
+        self.write(self.beacons[10:20], T0 + minutes(10))
+        reader = ArchiveReader(self.path)
+        self.assertEqual(len(reader), 20)
+        columns = reader.columns()
+        self.assertEqual(list(columns['temp']),
+                         [b.val_temp for b in self.beacons[:20]])
+        self.assertEqual(reader.addresses(),
+                         sorted(set(b.bt_address for b in self.beacons[:20])))
+
+    def test_unindexed_tail(self):
+        sink = ArchiveSink(self.path)
+        for i, b in enumerate(self.beacons[:5]):
+            sink(at(b, T0 + minutes(i)))
+        sink.flush()
+        self.assertEqual(len(ArchiveReader(self.path).query()), 5)
+        sink.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
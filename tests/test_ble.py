@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+
+import unittest
+
+from omron_envsensor.ble import BLE, BluezTransport, ScanProfile
+
+
+class FakeSocket(object):
+    # accepts the scan commands BluezTransport.setup sends
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def setsockopt(self, *args):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class CloseTest(unittest.TestCase):
+
+    def test_close_stops_duty_cycle(self):
+        ble = BLE(0)
+        ble.scan_profile = ScanProfile(on_time=0.01, off_time=0.01)
+        ble.sock = FakeSocket()
+        BluezTransport().setup(ble.sock, ble)
+        duty_cycle = ble.duty_cycle
+        self.assertTrue(duty_cycle._thread.is_alive())
+        sock = ble.sock
+        ble.close()
+        self.assertFalse(duty_cycle._thread.is_alive())
+        self.assertTrue(sock.closed)
+        self.assertIsNone(ble.duty_cycle)
+        self.assertIsNone(ble.sock)
+        sent = len(sock.sent)
+        duty_cycle._stop.wait(0.05)
+        self.assertEqual(len(sock.sent), sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from omron_envsensor import btsnoop
+from omron_envsensor.multi import MultiOmronEnvSensor
+from omron_envsensor.synthetic import TrafficGenerator
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source.btsnoop')
+        self.frames = TrafficGenerator().frames(50)
+        writer = btsnoop.BtsnoopWriter(self.source)
+        for frame in self.frames:
+            writer.write(frame)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_adapters_share_one_capture(self):
+        path = os.path.join(self.directory, 'recorded.btsnoop')
+        transport = btsnoop.RecordingTransport(
+            path, btsnoop.ReplayTransport(self.source))
+        sensor = MultiOmronEnvSensor('test', (0, 1))
+        sensor.transport = transport
+        sensor.open()
+        received = []
+        for device_id, sock in sensor.adapters:
+            for _ in range(10):
+                received.append(sock.recv(255))
+        sensor.close()
+        self.assertIsNone(transport.writer)
+        recorded = [frame for _, frame in btsnoop.read_btsnoop(path)]
+        self.assertEqual(recorded, received)
+
+
+if __name__ == '__main__':
+    unittest.main()
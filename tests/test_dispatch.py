@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import threading
+import unittest
+
+from omron_envsensor import OmronEnvSensor
+from omron_envsensor.dispatch import Dispatcher, DROP_OLDEST
+
+
+class Transport(object):
+
+    def open(self, ble):
+        return None
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_init_accepts_dispatcher_without_on_message(self):
+        sensor = OmronEnvSensor('test', 0)
+        sensor.transport = Transport()
+        sensor.dispatcher = Dispatcher(lambda r: None)
+        sensor.init()
+
+    def test_stop_under_drop_oldest_with_busy_producer(self):
+        release = threading.Event()
+        delivered = []
+
+        def callback(message):
+            release.wait()
+            delivered.append(message)
+        dispatcher = Dispatcher(callback, maxsize=2, workers=2,
+                                policy=DROP_OLDEST).start()
+        running = threading.Event()
+        running.set()
+
+        def produce():
+            i = 0
+            while running.is_set():
+                dispatcher.put(i)
+                i += 1
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        stopper = threading.Thread(target=dispatcher.stop)
+        stopper.daemon = True
+        stopper.start()
+        release.set()
+        stopper.join(5)
+        running.clear()
+        producer.join(5)
+        self.assertFalse(stopper.is_alive())
+        for t in dispatcher.threads:
+            self.assertFalse(t.is_alive())
+        self.assertFalse(dispatcher.put('late'))
+        self.assertNotIn('late', delivered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from omron_envsensor import OmronEnvSensor, btsnoop
+from omron_envsensor.multi import MultiOmronEnvSensor
+from omron_envsensor.synthetic import TrafficGenerator
+
+
+class ReplayLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'capture.btsnoop')
+        self.frames = TrafficGenerator(sensors=4).frames(200)
+        writer = btsnoop.BtsnoopWriter(self.path)
+        for frame in self.frames:
+            writer.write(frame)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sensor(self, realtime=False):
+        sensor = MultiOmronEnvSensor('test', (0, 1))
+        sensor.transport = btsnoop.ReplayTransport(
+            self.path, realtime=realtime, speed=1000.0)
+        return sensor
+
+    def expected(self):
+        single = OmronEnvSensor('test', 0)
+        return set((r.bt_address, r.seq_num)
+                   for frame in self.frames for r in single.decode(frame))
+
+    def run_loop(self, sensor):
+        delivered = []
+        sensor.on_message = delivered.append
+        sensor.init()
+        try:
+            sensor.loop()
+        finally:
+            sensor.close()
+        return delivered
+
+    def test_loop_ends_with_the_captures(self):
+        sensor = self.sensor()
+        delivered = self.run_loop(sensor)
+        keys = [(r.bt_address, r.seq_num) for r in delivered]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(set(keys), self.expected())
+        self.assertEqual(sensor.pending, {})
+        self.assertEqual(sensor.heard_by[0], sensor.heard_by[1])
+
+    def test_realtime_replay(self):
+        delivered = self.run_loop(self.sensor(realtime=True))
+        self.assertEqual(set((r.bt_address, r.seq_num) for r in delivered),
+                         self.expected())
+
+    def test_rejects_batching_and_instrumentation(self):
+        sensor = self.sensor()
+        sensor.batch_size = 8
+        with self.assertRaises(ValueError):
+            sensor.open()
+        sensor = self.sensor()
+        sensor.instrumentation = object()
+        with self.assertRaises(ValueError):
+            sensor.open()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+from __future__ import absolute_import
+
+import unittest
+
+from omron_envsensor import OmronEnvSensor
+from omron_envsensor.synthetic import TrafficGenerator
+
+
+class FirstOnly(OmronEnvSensor):
+    # pre multi-report style subclass: one beacon per event, relabelled
+
+    def filter(self, result):
+        r = super(FirstOnly, self).filter(result)
+        if r is not None:
+            r.gateway = 'filtered'
+        return r
+
+
+class FilterTest(unittest.TestCase):
+
+    def setUp(self):
+        generator = TrafficGenerator(sensors=8, foreign_ratio=0,
+                                     multi_ratio=1, max_reports=3)
+        self.frames = generator.frames(50)
+
+    def decode_all(self, sensor):
+        return [sensor.decode(frame) for frame in self.frames]
+
+    def test_every_report_is_delivered(self):
+        decoded = self.decode_all(OmronEnvSensor('test', 0))
+        self.assertTrue(any(len(beacons) > 1 for beacons in decoded))
+
+    def test_overridden_filter_is_honoured(self):
+        full = self.decode_all(OmronEnvSensor('test', 0))
+        for fast_decode in (False, True):
+            sensor = FirstOnly('test', 0)
+            sensor.fast_decode = fast_decode
+            decoded = self.decode_all(sensor)
+            self.assertEqual([len(beacons) for beacons in decoded],
+                             [min(len(beacons), 1) for beacons in full])
+            for beacons in decoded:
+                for r in beacons:
+                    self.assertEqual(r.gateway, 'filtered')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+import sys
+import unittest
+
+if sys.version_info >= (3, 8):
+    from omron_envsensor.pipeline import FrameRing, RING_COUNTER, _HEAD, _TAIL
+
+
+@unittest.skipIf(sys.version_info < (3, 8), 'shared memory needs 3.8+')
+class FrameRingTest(unittest.TestCase):
+
+    def ring(self, slots, start=0):
+        ring = FrameRing(slots)
+        self.addCleanup(ring.close, True)
+        RING_COUNTER.pack_into(ring.buf, _HEAD, start)
+        RING_COUNTER.pack_into(ring.buf, _TAIL, start)
+        return ring
+
+    def test_counter_wraparound(self):
+        ring = self.ring(4, 2 ** 32 - 5)
+        frames = [bytes([i]) * (i + 1) for i in range(20)]
+        received = []
+        for frame in frames:
+            self.assertTrue(ring.put(frame))
+            if ring.stats()['depth'] == 3:
+                # keep a few frames queued across the wrap
+                received.append(ring.get(0))
+        while len(received) < len(frames):
+            received.append(ring.get(0))
+        self.assertEqual(received, frames)
+        self.assertEqual(ring.stats()['depth'], 0)
+        self.assertLess(ring.stats()['written'], 2 ** 32 - 5)
+
+    def test_full_ring_across_wraparound(self):
+        ring = self.ring(4, 2 ** 32 - 2)
+        for i in range(4):
+            self.assertTrue(ring.put(b'%d' % i))
+        self.assertFalse(ring.put(b'x'))
+        self.assertEqual(ring.stats()['dropped'], 1)
+        self.assertEqual([ring.get(0) for _ in range(4)],
+                         [b'0', b'1', b'2', b'3'])
+
+    def test_slots_must_be_a_power_of_two(self):
+        with self.assertRaises(ValueError):
+            FrameRing(3000)
+        with self.assertRaises(ValueError):
+            FrameRing(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+
+import json
+import unittest
+
+from omron_envsensor.serialize import JSONSerializer
+
+from .helpers import make_beacons
+
+
+def strict_loads(text):
+    def reject(constant):
+        raise ValueError('not JSON: %s' % constant)
+    return json.loads(text, parse_constant=reject)
+
+
+class JSONSerializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.beacons = make_beacons(20, sensors=3)
+
+    def test_lines_match_json_format(self):
+        serializer = JSONSerializer()
+        for r in self.beacons:
+            self.assertEqual(strict_loads(serializer.line(r)),
+                             json.loads(r.json_format()))
+
+    def test_non_finite_numbers_are_null(self):
+        r = self.beacons[0]
+        r.val_temp = float('nan')
+        r.val_humi = float('inf')
+        r.distance = None
+        for precision in (None, 2):
+            line = strict_loads(JSONSerializer(precision=precision).line(r))
+            self.assertIsNone(line['temp'])
+            self.assertIsNone(line['humi'])
+            self.assertIsNone(line['distance'])
+            self.assertEqual(line['seq_num'], r.seq_num)
+            self.assertAlmostEqual(line['pressure'], r.val_pressure, 2)
+
+    def test_array(self):
+        self.beacons[1].val_noise = float('-inf')
+        parsed = strict_loads(JSONSerializer().array(self.beacons))
+        self.assertEqual(len(parsed), len(self.beacons))
+        self.assertIsNone(parsed[1]['noise'])
+
+
+if __name__ == '__main__':
+    unittest.main()